@@ -0,0 +1,102 @@
+from array import array
+
+from execution import *
+
+
+class Arena:
+    # many programs stored in flat arrays instead of Function trees: the node i is of the class of code ops[i] and
+    # has the children links[starts[i]:starts[i + 1]], a subtree common to several programs is stored once, and the
+    # program at position j is the node roots[j]. Function objects are only built when a program is read
+    def __init__(self):
+        self.ops = array('B')
+        self.starts = array('I', [0])
+        self.links = array('I')
+        self.roots = array('I')
+        self.indices = dict()
+
+    def __getstate__(self):
+        return self.ops, self.starts, self.links, self.roots
+
+    def __setstate__(self, state):
+        self.ops, self.starts, self.links, self.roots = state
+        self.index()
+
+    def __len__(self):
+        return len(self.roots)
+
+    def __getitem__(self, position):
+        return self.build(self.roots[position])
+
+    def __iter__(self):
+        for position in range(len(self.roots)):
+            yield self[position]
+
+    def node(self, code, children):
+        key = (code, *children)
+        index = self.indices.get(key)
+        if index is None:
+            index = self.indices[key] = len(self.ops)
+            self.ops.append(code)
+            self.links.extend(children)
+            self.starts.append(len(self.links))
+        return index
+
+    def add(self, program):
+        # stores program with a post-order walk on an explicit stack, returns its position
+        indices = []
+        stack = [(program, False)]
+        while stack:
+            function, visited = stack.pop()
+            if visited:
+                first = len(indices) - len(function.children)
+                children = indices[first:]
+                del indices[first:]
+                indices.append(self.node(function.code, children))
+            else:
+                stack.append((function, True))
+                stack.extend((child, False) for child in reversed(function.children))
+        self.roots.append(indices[0])
+        return len(self.roots) - 1
+
+    def extend(self, programs):
+        for program in programs:
+            self.add(program)
+
+    def build(self, index):
+        classes = tuple(language.functions.values())
+        built = dict()
+        stack = [index]
+        while stack:
+            i = stack[-1]
+            children = self.links[self.starts[i]:self.starts[i + 1]]
+            missing = [child for child in children if child not in built]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            built[i] = classes[self.ops[i]](*[built[child] for child in children])
+        return built[index]
+
+    def save(self, filename):
+        with open(filename, 'wb') as file:
+            array('q', (len(self.ops), len(self.links), len(self.roots))).tofile(file)
+            for values in (self.ops, self.starts, self.links, self.roots):
+                values.tofile(file)
+
+    @classmethod
+    def load(cls, filename):
+        arena = cls()
+        with open(filename, 'rb') as file:
+            header = array('q')
+            header.fromfile(file, 3)
+            nodes, links, roots = header
+            arena.ops.fromfile(file, nodes)
+            arena.starts = array('I')
+            arena.starts.fromfile(file, nodes + 1)
+            arena.links.fromfile(file, links)
+            arena.roots.fromfile(file, roots)
+        arena.index()
+        return arena
+
+    def index(self):
+        self.indices = {(code, *self.links[self.starts[i]:self.starts[i + 1]]): i for i, code in enumerate(self.ops)}
@@ -1,38 +1,326 @@
-from generator import Main
+import argparse
+import bisect
+import json
+from time import perf_counter
 
+from dovetail import Scheduler
+from execution import Interpreter, Tabulation
+import generator
+from generator import Equivalence, Generation, Main
+from pruning import Statistics
+from store import Store
 
-def beaver(values, value_range, max_step):
+
+class Result:
+    # outcome of the search on one size, champions hold (position, program) pairs and overflow holds
+    # (position, program, param) triples, param being the one the program ran out of steps on. The position of a
+    # program is its index in Main(1, value) so that shards can be merged back in the serial order
+    def __init__(self, value, score=-1, champions=(), overflow=()):
+        self.value = value
+        self.score = score
+        self.champions = list(champions)
+        self.overflow = list(overflow)
+
+    def record(self, position, program, param):
+        if param > self.score:
+            self.score = param
+            self.champions = [(position, program)]
+        elif param == self.score:
+            bisect.insort(self.champions, (position, program))
+
+    def merge(self, other):
+        if other.score > self.score:
+            self.score = other.score
+            self.champions = list(other.champions)
+        elif other.score == self.score:
+            self.champions = sorted(self.champions + other.champions, key=lambda champion: champion[0])
+        self.overflow = sorted(self.overflow + other.overflow, key=lambda program: program[0])
+        return self
+
+    def dump(self):
+        return {'value': self.value, 'score': self.score,
+                'champions': [[position, str(program)] for position, program in self.champions],
+                'overflow': [[position, str(program), param] for position, program, param in self.overflow]}
+
+    @classmethod
+    def load(cls, data):
+        interpreter = Interpreter()
+        return cls(data['value'], data['score'],
+                   [(position, interpreter.compile(program)) for position, program in data['champions']],
+                   [(position, interpreter.compile(program), param) for position, program, param in data['overflow']])
+
+    def display(self):
+        print('score: ', self.score, [program for _, program in self.champions])
+        print([program for _, program, _ in self.overflow])
+
+
+def shard(programs, index=0, count=1):
+    # the shard index of count takes every count-th program, which spreads the slow programs over the shards
+    for position, program in enumerate(programs):
+        if position % count == index:
+            yield position, program
+
+
+def run(program, executable, params, max_step, store=None, resumable=False):
+    # (True, param, None) for the first param the program answers on, (False, param, continuation) if it runs out
+    # of steps on param, the continuation of the lazy engine being kept only if resumable
+    for param in params:
+        if resumable:
+            step, output = executable.execute(param, step=max_step, bin_output=True, resumable=True)
+        elif store is None:
+            step, output = executable.execute(param, step=max_step, bin_output=True)
+        else:
+            step, output = store.execute(program, param, step=max_step, bin_output=True, executable=executable)
+        if step == max_step:
+            return False, param, output if resumable else None
+        if output:
+            return True, param, None
+    return None
+
+
+def run_strict(tabulation, program, params):
+    # run on the strict step model of tabulation, the continuation is always None
+    for param in params:
+        step, output = tabulation.execute(program, (param,))
+        if step == tabulation.step:
+            return False, param, None
+        if output:
+            return True, param, None
+    return None
+
+
+def search(value, value_range, max_step, backend=None, index=0, count=1, progress=False, store=None):
+    result = Result(value)
+    counter = 0
+    mod = Main.count(1, value) // count // 100 or 1
+    for position, program in shard(Main(1, value), index, count):
+        counter += 1
+        if progress and not counter % mod:
+            print('|', end='', flush=True)
+        executable = program.compile(backend) if backend else program
+        outcome = run(program, executable, range(value_range), max_step, store)
+        if outcome is not None:
+            answered, param, _ = outcome
+            if answered:
+                result.record(position, program, param)
+            else:
+                result.overflow.append((position, program, param))
+    return result
+
+
+def deepen(result, value_range, max_step, max_budget, factor=2, backend=None, store=None, strict=False):
+    # runs the overflow programs again with budgets growing geometrically up to max_budget, each one from the param
+    # it ran out of steps on, the params before it being known to answer 0. Stops once no program is left or the
+    # score is the last param of the range, which no overflow program can beat anymore. Without backend nor store,
+    # the lazy engine resumes the execution it ran out of steps on instead of starting it over. With strict, the
+    # result of tabulate is deepened on the strict step model, with a Tabulation per budget
+    resumable = not strict and backend is None and store is None
+    continuations = dict()
+    budget = max_step
+    while result.overflow and result.score < value_range - 1 and budget < max_budget:
+        budget = min(budget * factor, max_budget)
+        overflow, result.overflow = result.overflow, []
+        tabulation = Tabulation(budget) if strict else None
+        for position, program, start in overflow:
+            if strict:
+                outcome = run_strict(tabulation, program, range(start, value_range))
+                if outcome is not None:
+                    answered, param, _ = outcome
+                    if answered:
+                        result.record(position, program, param)
+                    else:
+                        result.overflow.append((position, program, param))
+                continue
+            executable = program.compile(backend) if backend else program
+            continuation = continuations.pop(position, None)
+            if continuation is not None:
+                step, output = continuation.resume(step=budget, bin_output=True, resumable=True)
+                if step == budget:
+                    continuations[position] = output
+                    result.overflow.append((position, program, start))
+                    continue
+                if output:
+                    result.record(position, program, start)
+                    continue
+                start += 1
+            outcome = run(program, executable, range(start, value_range), budget, store, resumable)
+            if outcome is not None:
+                answered, param, continuation = outcome
+                if answered:
+                    result.record(position, program, param)
+                else:
+                    result.overflow.append((position, program, param))
+                    if continuation is not None:
+                        continuations[position] = continuation
+    return result
+
+
+def sweep(value, value_range, max_step, backend=None, index=0, count=1, progress=False, store=None):
+    # search in parameter-major order: all the programs on param 0, then the ones still answering 0 on param 1 and
+    # so on, most of them being decided on the first params
+    result = Result(value)
+    population = [(position, program, program.compile(backend) if backend else program)
+                  for position, program in shard(Main(1, value), index, count)]
+    for param in range(value_range):
+        if progress:
+            print('|', end='', flush=True)
+        survivors = []
+        for position, program, executable in population:
+            outcome = run(program, executable, (param,), max_step, store)
+            if outcome is None:
+                survivors.append((position, program, executable))
+            elif outcome[0]:
+                result.record(position, program, param)
+            else:
+                result.overflow.append((position, program, param))
+        population = survivors
+    result.overflow.sort(key=lambda program: program[0])
+    return result
+
+
+def tabulate(value, value_range, max_step, index=0, count=1, progress=False, limit=1 << 20):
+    # search on the strict step model, where the cost of an application is the sum of the costs of its parts: one
+    # Tabulation holds the value tables of every subprogram of the size, so that a subprogram shared by many
+    # programs is applied to the same arguments only once. The tables are dropped when they exceed limit entries
+    result = Result(value)
+    tabulation = Tabulation(max_step)
+    counter = 0
+    mod = Main.count(1, value) // count // 100 or 1
+    for position, program in shard(Main(1, value), index, count):
+        counter += 1
+        if progress and not counter % mod:
+            print('|', end='', flush=True)
+        if len(tabulation.table) > limit:
+            tabulation.table.clear()
+        outcome = run_strict(tabulation, program, range(value_range))
+        if outcome is not None:
+            answered, param, _ = outcome
+            if answered:
+                result.record(position, program, param)
+            else:
+                result.overflow.append((position, program, param))
+    return result
+
+
+def dovetail(value, value_range, max_step, quantum=256, width=4096, index=0, count=1, progress=False):
+    # search evaluating width programs at once in quanta of steps, see dovetail.Scheduler
+    result = Result(value)
+    counter = 0
+    mod = Main.count(1, value) // count // 100 or 1
+    scheduler = Scheduler(value_range, max_step, quantum, width)
+    for position, program, param, answered in scheduler.run(shard(Main(1, value), index, count)):
+        counter += 1
+        if progress and not counter % mod:
+            print('|', end='', flush=True)
+        if answered:
+            result.record(position, program, param)
+        elif answered is not None:
+            result.overflow.append((position, program, param))
+    result.overflow.sort(key=lambda program: program[0])
+    return result
+
+
+def merge(results):
+    merged = dict()
+    for result in results:
+        if result.value in merged:
+            merged[result.value].merge(result)
+        else:
+            merged[result.value] = Result(result.value).merge(result)
+    return [merged[value] for value in sorted(merged)]
+
+
+def beaver(values, value_range, max_step, backend=None, index=0, count=1, store=None, max_budget=None, quantum=None,
+           param_major=False, strict=False):
+    results = []
     for value in values:
         print(value, end=': ')
-        score = -1
-        champions = []
-        overflow = []
-        counter = 0
-        total = 3.2 ** (value - 5)
-        mod = total // 100 or 1
-        for program in Main(1, value):
-            counter += 1
-            if not counter % mod:
-                print('|', end='', flush=True)
-            for param in range(value_range):
-                step, result = program.execute(param, step=max_step, bin_output=True)
-                if step == max_step:
-                    overflow.append(program)
-                    break
-                if result:
-                    if param > score:
-                        score = param
-                        champions = [program]
-                    elif param == score:
-                        champions.append(program)
-                    break
+        if strict:
+            result = tabulate(value, value_range, max_step, index, count, progress=True)
+        elif param_major:
+            result = sweep(value, value_range, max_step, backend, index, count, progress=True, store=store)
+        elif quantum:
+            result = dovetail(value, value_range, max_step, quantum, index=index, count=count, progress=True)
+        else:
+            result = search(value, value_range, max_step, backend, index, count, progress=True, store=store)
         print()
-        print('score: ', score, champions)
-        print(overflow)
+        if max_budget:
+            deepen(result, value_range, max_step, max_budget, backend=backend, store=store, strict=strict)
+        result.display()
+        results.append(result)
+    return results
+
+
+class Commandline(argparse.ArgumentParser):
+    """ Commandline parser """
+
+    def __init__(self):
+        super(Commandline, self).__init__(description="Search the busy beavers of the recursive language")
+
+        self.add_argument("values", type=int, nargs='*', default=list(range(20)), help="Sizes of the programs")
+        self.add_argument("-r", "--range", type=int, default=20, help="Parameters tried on each program")
+        self.add_argument("-s", "--max-step", type=int, default=10000, help="Step budget of an execution")
+        self.add_argument("-b", "--backend", choices=('closure', 'vm', 'optimized'), help="Execution backend")
+        self.add_argument("--shard", type=str, default='0/1', help="Evaluate only the shard i/N of each size")
+        self.add_argument("-o", "--output", type=str, help="Save the results of the shard in a json file")
+        self.add_argument("-m", "--merge", type=str, nargs='+', help="Merge the results saved by the shards")
+        self.add_argument("--store", type=str, help="SQLite file of the executions already done")
+        modes = self.add_mutually_exclusive_group()
+        modes.add_argument("-q", "--quantum", type=int,
+                           help="Dovetail the programs in quanta of steps on the lazy engine instead of one by one")
+        modes.add_argument("-p", "--param-major", action='store_true',
+                           help="Evaluate all the programs on a parameter before the next one")
+        modes.add_argument("-t", "--strict", action='store_true',
+                           help="Count the steps of the strict strategy, sharing the values of common subprograms")
+        self.add_argument("--prune", action='store_true',
+                          help="Build the programs from one subprogram per outputs on a few inputs, and report it")
+        self.add_argument("--rules-report", type=str,
+                          help="Count the hits and time of each pruning rule, report them and save them in a json file")
+        self.add_argument("-d", "--deepen", type=int, help="Run the overflow programs again up to this step budget")
 
 
 def main():
-    beaver(range(20), 20, 10000)
+    parser = Commandline()
+    commandline = parser.parse_args()
+    for mode, flag in ((commandline.quantum, '-q/--quantum'), (commandline.strict, '-t/--strict')):
+        if mode and (commandline.backend or commandline.store):
+            parser.error(f"argument {flag}: not allowed with argument -b/--backend nor --store")
+
+    if commandline.merge:
+        results = []
+        for filename in commandline.merge:
+            with open(filename) as file:
+                results.extend(Result.load(data) for data in json.load(file))
+        for result in merge(results):
+            print(result.value, end=': \n')
+            result.display()
+        return
+
+    index, count = map(int, commandline.shard.split('/'))
+    if commandline.prune:
+        Generation.pruning = Equivalence()
+    if commandline.rules_report:
+        generator.RULES.statistics = Statistics()
+    store = Store(commandline.store) if commandline.store else None
+    start = perf_counter()
+    try:
+        results = beaver(commandline.values, commandline.range, commandline.max_step, commandline.backend, index,
+                         count, store, commandline.deepen, commandline.quantum, commandline.param_major,
+                         commandline.strict)
+    finally:
+        if store is not None:
+            store.close()
+    if commandline.prune:
+        Generation.pruning.report()
+    if commandline.rules_report:
+        programs = sum(Main.count(1, value) for value in commandline.values)
+        data = generator.report(1, commandline.values, (perf_counter() - start) / (programs or 1))
+        with open(commandline.rules_report, 'w') as file:
+            json.dump(data, file, indent=1)
+
+    if commandline.output:
+        with open(commandline.output, 'w') as file:
+            json.dump([result.dump() for result in results], file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,411 @@
+import sys
+from weakref import WeakKeyDictionary
+
+from execution import *
+from machine import Machine
+
+
+class Found(Exception):
+    pass
+
+
+class State(Evaluation):
+    __slots__ = ('root', 'bin_output')
+
+    def __init__(self, step, token, poll, bin_output):
+        super().__init__(step, token, poll)
+        self.root = None
+        self.bin_output = bin_output
+
+
+# a thunk is a list [value, code, args], value being None until the thunk is closed
+
+
+def force(state, thunk):
+    # evaluates an unclosed thunk pushed on the stack, including the step that pops it,
+    # the closures inline it as a call followed by the push and pop steps
+    thunk[1](state, thunk, thunk[2])
+    state.step_counter += 1
+    if state.step_counter > state.budget:
+        state.check()
+
+
+class ClosureCompiler:
+    # every closure code(state, thunk, args) charges exactly the steps the lazy stack engine would charge,
+    # tail rewrites become direct calls to the child closure and projection chains are resolved into a slice
+
+    def __init__(self):
+        self.compilers = {Zero: self._zero, Identity: self._identity, Successor: self._successor,
+                          Left: self._projection, Right: self._projection,
+                          Composition: self._composition, Recursion: self._recursion}
+        self.codes = dict()
+
+    def compile(self, function):
+        # the subtrees a closure calls are compiled before it with an explicit stack, the compiler of a node then
+        # finds their closures built instead of recursing on the depth of the program
+        stack = [function]
+        while stack:
+            node = stack[-1]
+            if id(node) in self.codes:
+                stack.pop()
+                continue
+            pending = [child for child in self.subtrees(node) if id(child) not in self.codes]
+            if pending:
+                stack.extend(pending)
+            else:
+                stack.pop()
+                self.codes[id(node)] = self.build(node)
+        return self.codes[id(function)]
+
+    def build(self, function):
+        return self.compilers[function.__class__](function)
+
+    def subtrees(self, function):
+        # the subtrees the compiler of function compiles, a projection chain calling the node under it
+        if isinstance(function, Projection):
+            while isinstance(function, Projection):
+                function = function.children[0]
+            return function,
+        return function.children
+
+    def _zero(self, function):
+        def zero(state, thunk, args):
+            state.step_counter += 1
+            if state.step_counter > state.budget:
+                state.check()
+            thunk[0] = 0
+        return zero
+
+    def _identity(self, function):
+        def identity(state, thunk, args):
+            x = args[0]
+            if x[0] is None:
+                x[1](state, x, x[2])
+                state.step_counter += 2
+            state.step_counter += 1
+            if state.step_counter > state.budget:
+                state.check()
+            thunk[0] = x[0]
+        return identity
+
+    def _successor(self, function):
+        def successor(state, thunk, args):
+            if state.bin_output and thunk is state.root:
+                if state.step_counter < state.step:
+                    raise Found()
+                raise Overflow()
+            x = args[0]
+            if x[0] is None:
+                x[1](state, x, x[2])
+                state.step_counter += 2
+            state.step_counter += 1
+            if state.step_counter > state.budget:
+                state.check()
+            thunk[0] = x[0] + 1
+        return successor
+
+    def _projection(self, function):
+        front = back = count = 0
+        while isinstance(function, Projection):
+            if isinstance(function, Left):
+                front += 1
+            else:
+                back += 1
+            count += 1
+            function = function.children[0]
+        child = self.compile(function)
+        stop = -back or None
+
+        def projection(state, thunk, args):
+            state.step_counter += count
+            if state.step_counter > state.budget:
+                state.check()
+            return child(state, thunk, args[front:stop])
+        return projection
+
+    def _composition(self, function):
+        main = self.compile(function.children[0])
+        compounds = [self.compile(child) for child in function.children[1:]]
+
+        def composition(state, thunk, args):
+            state.step_counter += 1
+            if state.step_counter > state.budget:
+                state.check()
+            return main(state, thunk, tuple([[None, code, args] for code in compounds]))
+        return composition
+
+    def _recursion(self, function):
+        zero = self.compile(function.children[0])
+        recursive = self.compile(function.children[1])
+
+        def recursion(state, thunk, args):
+            n = args[0]
+            if n[0] is None:
+                n[1](state, n, n[2])
+                state.step_counter += 2
+            state.step_counter += 1
+            if state.step_counter > state.budget:
+                state.check()
+            if n[0]:
+                ne = [n[0] - 1]
+                rest = args[1:]
+                return recursive(state, thunk, (ne, [None, recursion, (ne,) + rest]) + rest)
+            return zero(state, thunk, args[1:])
+        return recursion
+
+
+def affine(v, k, w, n):
+    # v_n and v_0 + ... + v_{n-1} for the sequence v_{i+1} = k v_i + w
+    if k == 1:
+        return v + n * w, n * v + w * n * (n - 1) // 2
+    if k == 0:
+        return (w, v + (n - 1) * w) if n else (v, 0)
+    powers = (k ** n - 1) // (k - 1)
+    return k ** n * v + w * powers, v * powers + w * (powers - n) // (k - 1)
+
+
+class Optimizer(ClosureCompiler):
+    # closures of an optimised program that still charge the steps of the original one: a subtree that never
+    # evaluates its arguments is folded into its value and its cost, computed once if they take at most fold_limit
+    # steps, the compounds a Composition passes to a main function that never evaluates them are not built, and the
+    # main functions of nested Compositions are entered at once, see Function.demand. The nodes being interned, the
+    # fold of a subtree is shared by all the programs containing it. The Recursions iterating an increment, like
+    # RI<>S (addition), or the addition of a parameter, like R<Z<RI<>S (multiplication), jump over their unfoldings,
+    # their value and their cost being given in closed form
+    fold_limit = 10000
+    folds = WeakKeyDictionary()
+
+    def build(self, function):
+        if function.children and not function.demand:
+            return self._constant(function) or super().build(function)
+        return super().build(function)
+
+    def subtrees(self, function):
+        # the demanded compounds and the innermost main of a flattened Composition, and the zero of the additive
+        # Recursion under a multiplicative one, see _composition and _recursion
+        if isinstance(function, Composition):
+            subtrees = []
+            while True:
+                main = function.children[0]
+                subtrees.extend(child for i, child in enumerate(function.children[1:]) if main.demand >> i & 1)
+                if not isinstance(main, Composition) or not main.demand:
+                    return (*subtrees, main)
+                function = main
+        if isinstance(function, Recursion):
+            recursive = function.children[1]
+            while isinstance(recursive, Projection):
+                recursive = recursive.children[0]
+            if isinstance(recursive, Recursion):
+                return (*function.children, recursive.children[0])
+        return super().subtrees(function)
+
+    def fold(self, function):
+        # the value and cost of function, and the step at which it becomes a Successor when it is the root under
+        # bin_output (None if it never does), or None if they take more than fold_limit steps
+        if function not in self.folds:
+            code = self.compilers[function.__class__](function)
+            args = (None,) * function.arity
+            try:
+                state = State(self.fold_limit, None, 1024, False)
+                thunk = [None, code, args]
+                code(state, thunk, args)
+                value, cost = thunk[0], state.step_counter
+                state = State(self.fold_limit, None, 1024, True)
+                state.root = [None, code, args]
+                try:
+                    code(state, state.root, args)
+                    found = None
+                except Found:
+                    found = state.step_counter
+                self.folds[function] = value, cost, found
+            except (Overflow, RecursionError):
+                self.folds[function] = None
+        return self.folds[function]
+
+    def _constant(self, function):
+        if self.fold(function) is None:
+            return None
+        value, cost, found = self.fold(function)
+
+        def constant(state, thunk, args):
+            if found is not None and state.bin_output and thunk is state.root:
+                state.step_counter += found
+                if state.step_counter < state.step:
+                    raise Found()
+                raise Overflow()
+            state.step_counter += cost
+            if state.step_counter > state.budget:
+                state.check()
+            thunk[0] = value
+        return constant
+
+    def _composition(self, function):
+        count = 0
+        layers = []
+        while True:
+            main = function.children[0]
+            demand = main.demand
+            layers.append([self.compile(child) if demand >> i & 1 else None
+                           for i, child in enumerate(function.children[1:])])
+            count += 1
+            if not isinstance(main, Composition) or not demand:
+                break
+            function = main
+        main = self.compile(main)
+
+        def composition(state, thunk, args):
+            state.step_counter += count
+            if state.step_counter > state.budget:
+                state.check()
+            for compounds in layers:
+                args = tuple([None if code is None else [None, code, args] for code in compounds])
+            return main(state, thunk, args)
+        return composition
+
+    def increment(self, function, position):
+        # (k, cost) if function, applied to arguments whose one at position is an unevaluated thunk, evaluates it and
+        # no other argument and returns its value plus k, charging cost steps besides the ones of the thunk
+        if isinstance(function, (Identity, Successor)):
+            return (int(isinstance(function, Successor)), 3) if position == 0 else None
+        if isinstance(function, Projection):
+            child = function.children[0]
+            if isinstance(function, Left):
+                found = self.increment(child, position - 1) if position > 0 else None
+            else:
+                found = self.increment(child, position) if position < child.arity else None
+            return None if found is None else (found[0], found[1] + 1)
+        if isinstance(function, Composition):
+            main = function.children[0]
+            j = main.demand.bit_length() - 1
+            if j < 0 or main.demand != 1 << j:
+                return None
+            outer, inner = self.increment(main, j), self.increment(function.children[j + 1], position)
+            if outer is None or inner is None:
+                return None
+            return outer[0] + inner[0], 1 + outer[1] + inner[1]
+        return None
+
+    def _recursion(self, function):
+        plain = super()._recursion(function)
+        recursive = function.children[1]
+        increment = self.increment(recursive, 1)
+        if increment is not None:
+            return self._additive(function, plain, *increment)
+        projections = back = 0
+        while isinstance(recursive, Projection):
+            projections += 1
+            back += isinstance(recursive, Right)
+            recursive = recursive.children[0]
+        if projections - back == 1 and isinstance(recursive, Recursion):
+            increment = self.increment(recursive.children[1], 1)
+            if increment is not None:
+                return self._multiplicative(function, plain, projections, back, recursive, *increment)
+        return plain
+
+    def _additive(self, function, plain, k, cost):
+        # R(z, r) with r adding k to the recursive call: each unfolding costs cost + 1 steps
+        zero = self.compile(function.children[0])
+
+        def recursion(state, thunk, args):
+            n = args[0]
+            if n[0] is None:
+                n[1](state, n, n[2])
+                state.step_counter += 2
+            if not n[0] or state.bin_output and thunk is state.root:
+                return plain(state, thunk, args)
+            state.step_counter += n[0] * (cost + 1) + 1
+            if state.step_counter > state.budget:
+                state.check()
+            base = [None, zero, args[1:]]
+            zero(state, base, base[2])
+            thunk[0] = base[0] + k * n[0]
+        return recursion
+
+    def _multiplicative(self, function, plain, projections, back, inner, k, cost):
+        # R(z, P(R(y, r))) with P projections dropping the predecessor, and back arguments from the end, and
+        # R(y, r) additive: each unfolding adds k times the previous value plus the value w of y. y is evaluated
+        # once for real, forcing the arguments it needs, then once more on them to measure its cost from then on
+        zero = self.compile(function.children[0])
+        inner_zero = self.compile(inner.children[0])
+
+        def recursion(state, thunk, args):
+            n = args[0]
+            if n[0] is None:
+                n[1](state, n, n[2])
+                state.step_counter += 2
+            if not n[0] or state.bin_output and thunk is state.root:
+                return plain(state, thunk, args)
+            n = n[0]
+            rest = args[1:]
+            state.step_counter += 1 + n * (projections + 4)
+            if state.step_counter > state.budget:
+                state.check()
+            base = [None, zero, rest]
+            zero(state, base, rest)
+            params = rest[:len(rest) - back]
+            first = [None, inner_zero, params]
+            inner_zero(state, first, params)
+            scratch = State(-1, None, 1024, False)
+            inner_zero(scratch, [None, inner_zero, params], params)
+            value, total = affine(base[0], k, first[0], n)
+            state.step_counter += (n - 1) * scratch.step_counter + (cost + 1) * total
+            if state.step_counter > state.budget:
+                state.check()
+            thunk[0] = value
+        return recursion
+
+
+class Closure:
+    # the closures recurse on the thunks they force, a few frames a step. From Python 3.11 on, calls between Python
+    # functions take no C stack and the recursion limit only bounds memory, as the stack of the lazy engine does,
+    # so it is lifted while compiling and running. Before, it is raised to 100000 and a program compiling or
+    # running deeper is run on the lazy engine instead, from its first step
+    recursion_limit = 100000 if sys.version_info < (3, 11) else 2 ** 31 - 1
+    compiler = ClosureCompiler
+
+    def __init__(self, program):
+        self.program = program
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, self.recursion_limit))
+        try:
+            self.code = self.compiler().compile(program)
+        except RecursionError:
+            self.code = None
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def __str__(self):
+        return str(self.program)
+
+    __repr__ = __str__
+
+    def execute(self, *params, step=-1, display=(), bin_output=False, token=None, poll=1024):
+        # on overflow the result is None, the lazy engine returns whatever the top of its stack held
+        if display or self.code is None:
+            return self.program.execute(*params, step=step, display=display, bin_output=bin_output, token=token,
+                                        poll=poll)
+        if self.program.arity != len(params):
+            raise ArityException(self.program, self.program.arity, len(params))
+        state = State(step, token, poll, bin_output)
+        state.root = [None, self.code, tuple([param] for param in params)]
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, self.recursion_limit))
+        try:
+            force(state, state.root)
+        except Found:
+            return state.step_counter, True
+        except Overflow:
+            return step, None
+        except RecursionError:
+            return self.program.execute(*params, step=step, bin_output=bin_output, token=token, poll=poll)
+        finally:
+            sys.setrecursionlimit(limit)
+        return state.step_counter, state.root[0]
+
+
+class Optimized(Closure):
+    # the closures of Optimizer, see Closure
+    compiler = Optimizer
+
+
+backends = {'closure': Closure, 'vm': Machine, 'optimized': Optimized}
@@ -0,0 +1,72 @@
+import heapq
+
+from execution import Continuation
+
+
+class Task:
+    # a program under evaluation: the param it runs on, the continuation of that run and the steps spent on the
+    # program so far, which is its priority
+    __slots__ = ('position', 'program', 'param', 'continuation', 'spent')
+
+    def __init__(self, position, program):
+        self.position = position
+        self.program = program
+        self.param = 0
+        self.continuation = Continuation.start(program, 0)
+        self.spent = 0
+
+    def __lt__(self, other):
+        return (self.spent, self.position) < (other.spent, other.position)
+
+
+class Scheduler:
+    # dovetails the executions of many programs in quanta of steps, always advancing the program that has cost the
+    # least so far, so that the quick programs are decided first and a slow one only delays itself. Each run of a
+    # program on a param is still limited to max_step steps, so the decisions are the ones of beaver.search
+    def __init__(self, value_range, max_step, quantum=256, width=4096):
+        self.value_range = value_range
+        self.max_step = max_step
+        self.quantum = quantum
+        self.width = width
+        self.tasks = []
+
+    def run(self, programs):
+        # yields (position, program, param, answered) for every program as soon as it is decided: answered is True
+        # if it answers on param, False if it runs out of steps on param and None (param None too) if it answers
+        # 0 on every param. At most width programs are in progress at once
+        programs = iter(programs)
+        for position, program in programs:
+            heapq.heappush(self.tasks, Task(position, program))
+            if len(self.tasks) >= self.width:
+                break
+        while self.tasks:
+            task = self.tasks[0]
+            outcome = self.advance(task)
+            if outcome is None:
+                heapq.heapreplace(self.tasks, task)
+                continue
+            yield outcome
+            following = next(programs, None)
+            if following is None:
+                heapq.heappop(self.tasks)
+            else:
+                heapq.heapreplace(self.tasks, Task(*following))
+
+    def advance(self, task):
+        # runs one quantum of task, returns None if it goes on, its decision otherwise
+        before = task.continuation.step_counter
+        budget = min(before + self.quantum, self.max_step)
+        step, output = task.continuation.resume(step=budget, bin_output=True, resumable=True)
+        task.spent += step - before
+        if step == budget:
+            if step == self.max_step:
+                return task.position, task.program, task.param, False
+            return None
+        if output:
+            return task.position, task.program, task.param, True
+        task.param += 1
+        if task.param == self.value_range:
+            return task.position, task.program, None, None
+        task.continuation = Continuation.start(task.program, task.param)
+        return None
+
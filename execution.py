@@ -1,4 +1,9 @@
+import mmap
+import os
+import sys
+from itertools import count
 from time import time
+from weakref import WeakValueDictionary
 
 
 class ArityException(Exception):
@@ -15,6 +20,39 @@ class InvalidProgram(Exception):
     pass
 
 
+class Overflow(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    def __init__(self, step_counter, continuation=None):
+        self.step_counter = step_counter
+        self.continuation = continuation
+
+    def __str__(self):
+        return f"Cancelled after {self.step_counter} steps"
+
+
+class Node(type):
+    # Function classes are hash-consed: building a node whose class and children already exist returns the
+    # existing node, so structurally identical subtrees are a single immutable object
+    nodes = WeakValueDictionary()
+    uids = count()
+
+    def __new__(mcs, name, bases, attributes):
+        attributes.setdefault('__slots__', ())
+        return super().__new__(mcs, name, bases, attributes)
+
+    def __call__(cls, *args):
+        key = (cls, *[getattr(arg, 'uid', arg) for arg in args])
+        node = Node.nodes.get(key)
+        if node is None:
+            node = super().__call__(*args)
+            object.__setattr__(node, 'uid', next(Node.uids))
+            Node.nodes[key] = node
+        return node
+
+
 class Language:
     def __init__(self):
         self.functions = dict()
@@ -24,7 +62,9 @@ class Language:
         if isinstance(item, str):
             if item not in self.functions:
                 def metaclass(name, bases, attributes):
-                    cls = type(name, bases, attributes)
+                    cls = Node(name, bases, attributes)
+                    cls.code = len(self.functions)
+                    cls.feature = 1 << cls.code
                     self.functions[item] = cls
                     self.grammar[cls] = item
                     return cls
@@ -57,36 +97,40 @@ class Expression:
     __repr__ = __str__
 
 
-class Function:
-    def __init__(self, arity=0, depth=0, *children):
-        self.arity = arity
-        self.depth = depth
-        self.children = children
-
-    def __call__(self, *expression):
-        if self.arity != len(expression):
-            raise ArityException(self, self.arity, len(expression))
-
-    def __str__(self):
-        return f"{self.print()}{''.join(map(str, self.children))}"
-
-    __repr__ = __str__
+class Continuation:
+    # paused execution of the lazy engine: the stack of expressions left to evaluate, the root expression holding
+    # the result and the steps already spent. resume(step) carries on until step steps in total, exactly as if
+    # execute had been given that budget from the start
+    def __init__(self, program, stack, root, step_counter=0):
+        self.program = program
+        self.stack = stack
+        self.root = root
+        self.step_counter = step_counter
 
     @classmethod
-    def print(cls):
-        return language[cls]
-
-    def execute(self, *params, step=-1, display=(), bin_output=False):
-        step_counter = 0
+    def start(cls, program, *params):
         stack = list()
-        peek = Expression(self, stack, *[Expression(arg) for arg in params])
-        stack.append(peek)
-        if step_counter in display:
-            print(step_counter, f"{self}({', '.join(map(str, params))})")
+        root = Expression(program, stack, *[Expression(arg) for arg in params])
+        stack.append(root)
+        return cls(program, stack, root)
+
+    def resume(self, step=-1, display=(), bin_output=False, token=None, poll=1024, resumable=False):
+        # returns (step, result) like execute, the result being this continuation when the budget is exhausted
+        # and resumable is set. On a cancellation the continuation is left before the step being charged
+        stack = self.stack
+        step_counter = self.step_counter
+        checkpoint = -1 if token is None else step_counter + poll
+        peek = self.root
         while stack and (step == -1 or step > step_counter):
             if bin_output and isinstance(stack[0].what, Successor):
+                self.step_counter = step_counter
                 return step_counter, True
             step_counter += 1
+            if step_counter == checkpoint:
+                if token.cancelled():
+                    self.step_counter = step_counter - 1
+                    raise Cancelled(step_counter, self)
+                checkpoint += poll
             peek = stack[-1]
             if step_counter in display:
                 print(step_counter, stack)
@@ -94,13 +138,205 @@ class Function:
                 stack.pop()
             else:
                 peek()
-        if bin_output:
-            return step_counter, peek.what
+        self.step_counter = step_counter
+        if resumable and step_counter == step:
+            return step_counter, self
         return step_counter, peek.what
 
+    def dump(self):
+        # flat encoding of the expressions reachable from the root and the stack, the root first: a closed
+        # expression is its value, an open one [function, *params] with indices in functions and expressions,
+        # the stack every open expression holds as first parameter being implicit
+        expressions = []
+        indices = dict()
+        functions = dict()
+        pending = [self.root, *self.stack]
+        for expression in pending:
+            if id(expression) not in indices:
+                indices[id(expression)] = len(expressions)
+                expressions.append(expression)
+                if not expression.closed:
+                    pending.extend(expression.params[1:])
+        encoded = []
+        for expression in expressions:
+            if expression.closed:
+                encoded.append(expression.what)
+            else:
+                function = functions.setdefault(expression.what, len(functions))
+                encoded.append([function, *[indices[id(param)] for param in expression.params[1:]]])
+        return {'program': str(self.program),
+                'step': self.step_counter,
+                'functions': [str(function) for function in functions],
+                'expressions': encoded,
+                'stack': [indices[id(expression)] for expression in self.stack]}
+
     @classmethod
-    def build(cls, program):
-        return cls()
+    def load(cls, data):
+        interpreter = Interpreter()
+        functions = [interpreter.compile(function) for function in data['functions']]
+        stack = list()
+        expressions = [Expression(value) if isinstance(value, int) else Expression(functions[value[0]], stack)
+                       for value in data['expressions']]
+        for expression, value in zip(expressions, data['expressions']):
+            if not expression.closed:
+                expression.params = (stack, *[expressions[index] for index in value[1:]])
+        stack.extend(expressions[index] for index in data['stack'])
+        return cls(interpreter.compile(data['program']), stack, expressions[0], data['step'])
+
+
+class Evaluation:
+    # step counter of the strict strategy: one step per application of a function, a Recursion applied to n
+    # being unfolded n + 1 times. When every argument is demanded, the lazy engine charges the strict count plus
+    # 2 steps (push and pop) per thunk, a thunk being a compound of an applied Composition or the recursive call
+    # of an unfolding with n > 0, plus 1 step to pop the result ; otherwise it is lower by the cost of the
+    # arguments it never evaluates.
+    # The strict evaluation recurses on the nesting of the program, unlike the lazy engine, the unfoldings of a
+    # Recursion being iterated: a program nested deeper than the recursion limit allows raises ValueError, see deep
+    # budget is the next step at which check() must be called: the step limit, or the next poll of the token
+    __slots__ = ('step', 'step_counter', 'budget', 'token', 'poll')
+
+    def __init__(self, step=-1, token=None, poll=1024):
+        self.step = float('inf') if step == -1 else step
+        self.step_counter = 0
+        self.token = token
+        self.poll = poll
+        self.budget = self.step if token is None else min(self.step, poll)
+
+    def tick(self):
+        self.step_counter += 1
+        if self.step_counter > self.budget:
+            self.check()
+
+    def check(self):
+        if self.step_counter > self.step:
+            raise Overflow()
+        if self.token.cancelled():
+            raise Cancelled(self.step_counter)
+        self.budget = min(self.step, self.step_counter + self.poll)
+
+    @staticmethod
+    def deep(function):
+        return ValueError(f"program of size {function.size} nested too deep for the strict strategy, whose "
+                          f"evaluation recurses on the nesting of the program (recursion limit "
+                          f"{sys.getrecursionlimit()})")
+
+
+class Function(metaclass=Node):
+    # besides its arity and depth, a node carries from its construction its size, the features of its subtree (the
+    # union of the feature bits of the classes of its nodes), a structural digest, a hash of its letter and the
+    # digests of its children that is the same in every process, and its demand, the bits of the positions of the
+    # arguments the lazy engine may evaluate when applying it
+    __slots__ = ('arity', 'depth', 'children', 'wildcard', 'size', 'features', 'digest', 'demand', 'uid',
+                 '__weakref__')
+    feature = 0
+
+    def __init__(self, arity=0, depth=0, *children):
+        object.__setattr__(self, 'arity', arity)
+        object.__setattr__(self, 'depth', depth)
+        object.__setattr__(self, 'children', children)
+        object.__setattr__(self, 'wildcard', self.__class__ is Function or any(child.wildcard for child in children))
+        features = self.feature
+        for child in children:
+            features |= child.features
+        object.__setattr__(self, 'size', 1 + sum(child.size for child in children))
+        object.__setattr__(self, 'features', features)
+        head = -1 - arity if self.__class__ is Function else ord(language[self.__class__])
+        object.__setattr__(self, 'digest', hash((head, *(child.digest for child in children))))
+        object.__setattr__(self, 'demand', self.demanded(*children))
+
+    def demanded(self, *children):
+        return (1 << self.arity) - 1
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"'{self.__class__.__name__}' nodes are immutable")
+
+    def __reduce__(self):
+        if self.__class__ is Function:
+            return Function, (self.arity,)
+        return self.__class__, self.children
+
+    def encode(self):
+        # the prefix string of the program as ascii bytes, one byte per node, see Interpreter.decode
+        return str(self).encode('ascii')
+
+    def __call__(self, *expression):
+        if self.arity != len(expression):
+            raise ArityException(self, self.arity, len(expression))
+
+    def __str__(self):
+        # the letters in prefix order, walked with an explicit stack so that deep programs print too
+        letters = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            letters.append(node.print())
+            stack.extend(reversed(node.children))
+        return ''.join(letters)
+
+    __repr__ = __str__
+
+    @classmethod
+    def print(cls):
+        return language[cls]
+
+    def evaluate(self, evaluation, *x):
+        raise NotImplementedError()
+
+    def execute(self, *params, step=-1, display=(), bin_output=False, strategy='lazy', token=None, poll=1024,
+                resumable=False):
+        # token.cancelled() is polled every poll steps, Cancelled is raised once it returns True. With resumable,
+        # an exhausted budget returns (step, continuation) instead of (step, None), see Continuation
+        if strategy == 'strict':
+            if resumable:
+                raise ValueError("only the lazy strategy is resumable")
+            return self.execute_strict(*params, step=step, bin_output=bin_output, token=token, poll=poll)
+        if strategy != 'lazy':
+            raise ValueError(f"unknown strategy '{strategy}', expected lazy or strict")
+        continuation = Continuation.start(self, *params)
+        if 0 in display:
+            print(0, f"{self}({', '.join(map(str, params))})")
+        return continuation.resume(step, display, bin_output, token, poll, resumable)
+
+    def execute_many(self, params_array, step=-1, bin_output=False, strategy='lazy', backend='closure'):
+        # runs the program on every tuple of params_array, returns the list of the steps and the list of the results.
+        # The lazy strategy compiles the program once with backend for all the inputs (backend None runs the lazy
+        # stack engine on each), the strict one shares the applications already evaluated on the previous inputs,
+        # see Tabulation
+        params_array = [tuple(map(int, params)) for params in params_array]
+        steps, results = [], []
+        if strategy == 'strict':
+            tabulation = Tabulation(step)
+            for params in params_array:
+                step_counter, result = tabulation.execute(self, params)
+                steps.append(step_counter)
+                results.append(True if bin_output and result else result)
+            return steps, results
+        executable = self.compile(backend) if backend else self
+        for params in params_array:
+            step_counter, result = executable.execute(*params, step=step, bin_output=bin_output)
+            steps.append(step_counter)
+            results.append(result)
+        return steps, results
+
+    def execute_strict(self, *params, step=-1, bin_output=False, token=None, poll=1024):
+        if self.arity != len(params):
+            raise ArityException(self, self.arity, len(params))
+        evaluation = Evaluation(step, token, poll)
+        try:
+            result = self.evaluate(evaluation, *params)
+        except Overflow:
+            return step, None
+        except RecursionError:
+            raise evaluation.deep(self) from None
+        if bin_output and result:
+            return evaluation.step_counter, True
+        return evaluation.step_counter, result
+
+    def compile(self, backend='closure'):
+        from compilation import backends
+        if backend not in backends:
+            raise ValueError(f"unknown backend '{backend}', expected one of {', '.join(backends)}")
+        return backends[backend](self)
 
     def __iter__(self):
         yield self
@@ -108,24 +344,46 @@ class Function:
             yield from child
 
     def __contains__(self, item):
+        # whether item is a strict subtree, an atom being looked up in the features of the children alone
+        if not item.wildcard:
+            if not item.children:
+                return any(child.features & item.feature for child in self.children)
+            if item.size >= self.size or item.features & ~self.features:
+                return False
         if any(child == item for child in self.children):
             return True
         return any(item in child for child in self.children)
 
     def __eq__(self, other):
-        if other.__class__ == Function:
+        # interned nodes are equal only if identical, the structural comparison is left to the patterns
+        # containing a Function(arity) wildcard, which matches any function of that arity
+        if self is other:
+            return True
+        if not isinstance(other, Function) or not (self.wildcard or other.wildcard):
+            return False
+        if other.__class__ is Function or self.__class__ is Function:
             return self.arity == other.arity
-        if self.__class__ == other.__class__:
+        if self.__class__ is other.__class__ and len(self.children) == len(other.children):
             return all(self_child == other_child for self_child, other_child in zip(self.children, other.children))
         return False
 
+    def __hash__(self):
+        return self.digest
+
 
 class Zero(Function, metaclass=language['Z']):
+    def demanded(self):
+        return 0
+
     def __call__(self, master, stack, *expression):
         super().__call__(*expression)
         master.what = 0
         master.closed = True
 
+    def evaluate(self, evaluation):
+        evaluation.tick()
+        return 0
+
 
 class Identity(Function, metaclass=language['I']):
     def __init__(self):
@@ -139,6 +397,10 @@ class Identity(Function, metaclass=language['I']):
         else:
             stack.append(expression[0])
 
+    def evaluate(self, evaluation, x):
+        evaluation.tick()
+        return x
+
 
 class Successor(Function, metaclass=language['S']):
     def __init__(self):
@@ -152,29 +414,43 @@ class Successor(Function, metaclass=language['S']):
         else:
             stack.append(expression[0])
 
+    def evaluate(self, evaluation, x):
+        evaluation.tick()
+        return x + 1
+
 
 class Projection(Function):
     def __init__(self, children: Function):
         super().__init__(children.arity + 1, children.depth, children)
 
-    @classmethod
-    def build(cls, program):
-        return cls(Interpreter.next_function(program))
-
 
 class Left(Projection, metaclass=language['<']):
+    def demanded(self, child):
+        return child.demand << 1
+
     def __call__(self, master, stack, *expression):
         super().__call__(*expression)
         master.what = self.children[0]
         master.params = (stack, *expression[1:])
 
+    def evaluate(self, evaluation, *x):
+        evaluation.tick()
+        return self.children[0].evaluate(evaluation, *x[1:])
+
 
 class Right(Projection, metaclass=language['>']):
+    def demanded(self, child):
+        return child.demand
+
     def __call__(self, master, stack, *expression):
         super().__call__(*expression)
         master.what = self.children[0]
         master.params = (stack, *expression[:-1])
 
+    def evaluate(self, evaluation, *x):
+        evaluation.tick()
+        return self.children[0].evaluate(evaluation, *x[:-1])
+
 
 class Composition(Function, metaclass=language['o']):
     def __init__(self, *children: Function):
@@ -182,15 +458,21 @@ class Composition(Function, metaclass=language['o']):
         if len(children) != children[0].arity + 1:
             raise ArityException(self, children[0].arity + 1, len(children))
 
+    def demanded(self, main, *compounds):
+        demand = 0
+        for i, compound in enumerate(compounds):
+            if main.demand >> i & 1:
+                demand |= compound.demand
+        return demand
+
     def __call__(self, master, stack, *expression):
         super().__call__(*expression)
         master.what = self.children[0]
         master.params = (stack, *[Expression(child, stack, *expression) for child in self.children[1:]])
 
-    @classmethod
-    def build(cls, program):
-        main_child = next(program).build(program)
-        return cls(main_child, *[Interpreter.next_function(program) for _ in range(main_child.arity)])
+    def evaluate(self, evaluation, *x):
+        evaluation.tick()
+        return self.children[0].evaluate(evaluation, *[child.evaluate(evaluation, *x) for child in self.children[1:]])
 
 
 class Recursion(Function, metaclass=language['R']):
@@ -199,6 +481,10 @@ class Recursion(Function, metaclass=language['R']):
         if zero.arity + 1 != recursive.arity - 1:
             raise ArityException(self, zero.arity + 1, recursive.arity - 1)
 
+    def demanded(self, zero, recursive):
+        # the recursive function's arguments are the predecessor, the recursive call and the other ones
+        return 1 | zero.demand << 1 | recursive.demand >> 1
+
     def __call__(self, master, stack, *expression):
         super().__call__(*expression)
         if expression[0].closed:
@@ -212,32 +498,186 @@ class Recursion(Function, metaclass=language['R']):
         else:
             stack.append(expression[0])
 
-    @classmethod
-    def build(cls, program):
-        return cls(Interpreter.next_function(program), Interpreter.next_function(program))
+    def evaluate(self, evaluation, n, *x):
+        evaluation.tick()
+        result = self.children[0].evaluate(evaluation, *x)
+        for i in range(n):
+            evaluation.tick()
+            result = self.children[1].evaluate(evaluation, i, result, *x)
+        return result
+
+
+class Tabulation(Evaluation):
+    # strict evaluation memoising every application of a function to its arguments with its result and its cost, so
+    # that the evaluations of a program on many inputs share their sub-computations. A Recursion applied to n also
+    # records its values on the smaller n it goes through. The step counter is the one of the current input, an
+    # application found in the table being charged its whole cost at once
+    __slots__ = ('table', 'rules')
+
+    def __init__(self, step=-1):
+        super().__init__(step)
+        self.table = dict()
+        self.rules = {Zero: self.zero, Identity: self.identity, Successor: self.successor, Left: self.left,
+                      Right: self.right, Composition: self.composition, Recursion: self.recursion}
+
+    def execute(self, function, params):
+        if function.arity != len(params):
+            raise ArityException(function, function.arity, len(params))
+        self.step_counter = 0
+        try:
+            result = self.apply(function, params)
+        except Overflow:
+            return self.step, None
+        except RecursionError:
+            raise self.deep(function) from None
+        return self.step_counter, result
+
+    def charge(self, steps):
+        self.step_counter += steps
+        if self.step_counter > self.budget:
+            self.check()
+
+    def apply(self, function, x):
+        key = (function, *x)
+        known = self.table.get(key)
+        if known is not None:
+            self.charge(known[1])
+            return known[0]
+        start = self.step_counter
+        result = self.rules[function.__class__](function, x)
+        self.table[key] = (result, self.step_counter - start)
+        return result
+
+    def zero(self, function, x):
+        self.tick()
+        return 0
+
+    def identity(self, function, x):
+        self.tick()
+        return x[0]
+
+    def successor(self, function, x):
+        self.tick()
+        return x[0] + 1
+
+    def left(self, function, x):
+        self.tick()
+        return self.apply(function.children[0], x[1:])
+
+    def right(self, function, x):
+        self.tick()
+        return self.apply(function.children[0], x[:-1])
+
+    def composition(self, function, x):
+        self.tick()
+        return self.apply(function.children[0], [self.apply(child, x) for child in function.children[1:]])
+
+    def recursion(self, function, x):
+        start = self.step_counter
+        n, x = x[0], tuple(x[1:])
+        zero, recursive = function.children
+        i = n - 1
+        while i >= 0 and (function, i, *x) not in self.table:
+            i -= 1
+        if i < 0:
+            self.tick()
+            result = self.apply(zero, x)
+            i = 0
+            self.table[(function, 0, *x)] = (result, self.step_counter - start)
+        else:
+            result, cost = self.table[(function, i, *x)]
+            self.charge(cost)
+        for i in range(i, n):
+            self.tick()
+            result = self.apply(recursive, (i, result, *x))
+            self.table[(function, i + 1, *x)] = (result, self.step_counter - start)
+        return result
+
+
+OPERANDS = {Left: 1, Right: 1, Recursion: 2}
+CHUNK = 1 << 16
+
+
+def slices(data, chunk=CHUNK):
+    # the decoded slices of bytes-like data such as an mmap. Latin-1 maps every byte to one character: the letters
+    # of the language being ASCII, any other byte is skipped like a character outside the language in a string
+    for start in range(0, len(data), chunk):
+        yield str(data[start:start + chunk], 'latin-1')
 
 
 class Interpreter:
     def __init__(self, functions=language):
         self.language = functions
 
-    def compile(self, code):
-        instructions = self.parse(code)
-        program = Interpreter.next_function(instructions)
-        if len(list(instructions)):
+    def compile(self, code, backend=None):
+        programs = self.programs(code)
+        program = next(programs, None)
+        if program is None or next(programs, None) is not None:
             raise InvalidProgram()
+        if backend is not None:
+            return program.compile(backend)
         return program
 
-    @staticmethod
-    def next_function(instructions):
-        try:
-            return next(instructions).build(instructions)
-        except StopIteration:
+    def compile_file(self, filename, backend=None, chunk=CHUNK):
+        # the file is mapped in memory and parsed in slices, an empty file cannot be mapped and holds no program
+        if not os.path.getsize(filename):
             raise InvalidProgram()
+        with open(filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return self.compile(slices(data, chunk), backend)
+
+    def compile_lines(self, lines):
+        # one program per non blank line, lines being for instance a file
+        for line in lines:
+            if not line.isspace() and line:
+                yield self.compile(line)
 
     def parse(self, code):
         return (self.language[char] for char in code if char in self.language)
 
+    def programs(self, code):
+        # yields the programs written one after the other in code, a string, bytes-like data such as an mmap, or an
+        # iterable of strings or bytes such as the chunks of a file. The nodes still missing children are kept on a
+        # stack with the children built so far, a Composition having as many children as the arity of its first one
+        # plus one
+        if isinstance(code, str):
+            code = (code,)
+        elif isinstance(code, (bytes, bytearray, memoryview, mmap.mmap)):
+            code = slices(code)
+        functions = self.language.functions
+        stack = []
+        for chunk in code:
+            if not isinstance(chunk, str):
+                chunk = str(chunk, 'latin-1')
+            for char in chunk:
+                cls = functions.get(char)
+                if cls is None:
+                    continue
+                if cls is Composition or cls in OPERANDS:
+                    stack.append((cls, []))
+                    continue
+                node = cls()
+                while stack:
+                    cls, children = stack[-1]
+                    children.append(node)
+                    if cls is Composition:
+                        operands = children[0].arity + 1
+                        if operands < 2:
+                            raise InvalidProgram()
+                    else:
+                        operands = OPERANDS[cls]
+                    if len(children) < operands:
+                        break
+                    stack.pop()
+                    node = cls(*children)
+                else:
+                    yield node
+        if stack:
+            raise InvalidProgram()
+
+    @staticmethod
+    def decode(data):
+        return Interpreter().compile(data.decode('ascii'))
+
 
 def main():
     t0 = time()
@@ -2,6 +2,9 @@ from itertools import product
 from math import factorial
 
 from execution import *
+from pruning import Rules
+
+RULES = Rules.load('generation.rules')
 
 
 class Generation:
@@ -29,9 +32,8 @@ class CompositionGenerator(Generation):
             for arity in range(1, size + 1):
                 for main_program in ZoR(arity, size):
                     for compound_program in self._compound(arity, self.size - 1 - size):
-                        if main_program.__class__ == Recursion and Zero() in compound_program:
-                            continue
-                        yield Composition(main_program, *compound_program)
+                        if not RULES.rejects(Composition, (main_program, *compound_program)):
+                            yield Composition(main_program, *compound_program)
 
     def _compound(self, n, size):
         for composition in self._composition(n, size):
@@ -68,28 +70,8 @@ class RecursionGenerator(Generation):
         for size in range(1, self.size - 1):
             for recursive in ZISRLoR(self.arity + 1, self.size - 1 - size):
                 for zero in ZISRLoR(self.arity - 1, size):
-                    if isinstance(zero, Projection) and recursive.__class__ == zero.__class__:
-                        continue
-                    if Zero() == zero:
-                        if recursive == Left(Function(1)) and Successor() not in recursive:
-                            continue
-                        if recursive == Left(Recursion(Zero(), Function(2))):
-                            continue
-                        if recursive == Recursion(Identity(), Function(3)):
-                            continue
-                        if recursive == Recursion(Left(Zero()), Function(3)):
-                            continue
-                        if recursive == Composition(Recursion(Zero(), Function(2)), Function(2)):
-                            continue
-                        if recursive == Recursion(Recursion(Zero(), Function(2)), Function(3)):
-                            continue
-                        if recursive == Recursion(Identity(), Right(Recursion(Identity(), Function(3)))):
-                            continue
-                        if recursive == Left(Composition(Recursion(Function(1), Function(3)), Function(1), Function(1))):
-                            continue
-                        if isinstance(recursive, Composition) and isinstance(recursive.children[0], Recursion):
-                            continue
-                    yield Recursion(zero, recursive)
+                    if not RULES.rejects(Recursion, (zero, recursive)):
+                        yield Recursion(zero, recursive)
 
 
 class ZoR(Generation):
@@ -1,54 +1,357 @@
+from collections import Counter, namedtuple
+from functools import lru_cache
 from itertools import product
+from math import gcd
 
 from execution import *
+from pruning import SUCCESSIVE, Rules
+
+ZERO = Zero()
+IDENTITY = Identity()
+RULES = Rules.load('generator.rules')
+
+# all the pruning rules look at is the shape of a program: its class, arity, whether it is only made of S and o,
+# and which sub-patterns of the rules it matches, so programs can be counted by shape instead of enumerated
+Shape = namedtuple('Shape', ('cls', 'arity', 'successive', 'matches'))
+
+
+@lru_cache(maxsize=None)
+def shape(cls, arity, successive, children=None, rules=RULES):
+    # children is None when the node is too wide for any structured pattern to match it
+    return Shape(cls, arity, successive, rules.matching(cls, children))
+
+
+def shape_of(program, rules=RULES):
+    children = tuple(shape_of(child, rules) for child in program.children)
+    successive = isinstance(program, (Successor, Composition)) and all(child.successive for child in children)
+    return shape(program.__class__, program.arity, successive, children, rules)
+
+
+def unit(_):
+    return 1
+
+
+def weighted(weight, census):
+    return sum(count * weight(program_shape) for program_shape, count in census.items())
+
+
+def size_of(program):
+    return program.size
 
 
 class Generation:
-    def __init__(self, arity, size):
+    # programs of every (generator, arity, size) used as a sub-space are enumerated once and kept in a table,
+    # a streaming generator enumerates its own programs lazily but still builds them from the tables. When pruning
+    # is set, the tables of programs are filtered by it, see Equivalence. A generation prunes with the rules it is
+    # given, RULES by default, and its tables and census are kept apart from the ones of other rules
+    tables = dict()
+    censuses = dict()
+    streaming = False
+    pruning = None
+
+    def __init__(self, arity, size, rules=RULES):
         self.arity = arity
         self.size = size
+        self.rules = rules
+
+    def __iter__(self):
+        return self.generate()
+
+    @classmethod
+    def table(cls, arity, size, rules=RULES):
+        key = (cls, arity, size, rules, Generation.pruning)
+        if key not in Generation.tables:
+            programs = cls(arity, size, rules).generate()
+            if Generation.pruning is not None and issubclass(cls, Generator):
+                programs = Generation.pruning.filter(cls, arity, size, programs)
+            Generation.tables[key] = tuple(programs)
+        return Generation.tables[key]
+
+    @classmethod
+    def census_table(cls, arity, size, rules=RULES):
+        key = (cls, arity, size, rules)
+        if key not in Generation.censuses:
+            Generation.censuses[key] = cls(arity, size, rules).census()
+        return Generation.censuses[key]
+
+    @classmethod
+    def count(cls, arity, size, rules=RULES):
+        return sum(cls.census_table(arity, size, rules).values())
+
+    def part(self, cls):
+        if self.streaming:
+            return cls(self.arity, self.size, self.rules)
+        return cls.table(self.arity, self.size, self.rules)
+
+    def census(self):
+        # number of programs of each shape that generate() yields
+        raise NotImplementedError()
+
+    def locate(self, weight, index):
+        # each program y counting for weight(shape of y), returns the program x such that the programs yielded
+        # before x weigh at most index and less than index - weight(x), and the index remaining inside x
+        raise NotImplementedError()
+
+    def position(self, weight, program):
+        # total weight of the programs yielded before program
+        raise NotImplementedError()
+
+    def _missing(self, program):
+        return ValueError(f"{program} is not generated by {self.__class__.__name__}({self.arity}, {self.size})")
 
 
 class LeftGenerator(Generation):
-    def __iter__(self):
-        for g in Generator(self.arity - 1, self.size - 1):
+    node = Left
+
+    def generate(self):
+        for g in Generator.table(self.arity - 1, self.size - 1, self.rules):
             yield Left(g)
 
+    def census(self):
+        census = Counter()
+        for child, count in Generator.census_table(self.arity - 1, self.size - 1, self.rules).items():
+            census[self.result(child)] += count
+        return census
+
+    def result(self, child):
+        return shape(Left, self.arity, False, (child,), self.rules)
+
+    def locate(self, weight, index):
+        child_weight = lru_cache()(lambda g: weight(self.result(g)))
+        child, index = Generator(self.arity - 1, self.size - 1, self.rules).locate(child_weight, index)
+        return Left(child), index
+
+    def position(self, weight, program):
+        return Generator(self.arity - 1, self.size - 1, self.rules).position(lambda g: weight(self.result(g)),
+                                                                             program.children[0])
+
 
 class RightGenerator(Generation):
-    def __iter__(self):
+    node = Right
+
+    def generate(self):
         if self.arity - 1:
-            for g in NoLeft(self.arity - 1, self.size - 1):
+            for g in NoLeft.table(self.arity - 1, self.size - 1, self.rules):
                 yield Right(g)
 
+    def census(self):
+        census = Counter()
+        if self.arity - 1:
+            for child, count in NoLeft.census_table(self.arity - 1, self.size - 1, self.rules).items():
+                census[self.result(child)] += count
+        return census
+
+    def result(self, child):
+        return shape(Right, self.arity, False, (child,), self.rules)
+
+    def locate(self, weight, index):
+        child_weight = lru_cache()(lambda g: weight(self.result(g)))
+        child, index = NoLeft(self.arity - 1, self.size - 1, self.rules).locate(child_weight, index)
+        return Right(child), index
+
+    def position(self, weight, program):
+        if not self.arity - 1:
+            raise self._missing(program)
+        return NoLeft(self.arity - 1, self.size - 1, self.rules).position(lambda g: weight(self.result(g)),
+                                                                          program.children[0])
+
 
 class CompositionGenerator(Generation):
-    def __iter__(self):
+    # the compound tuples are summarised by (their shapes if the composition is narrow enough for a rule to look at
+    # them, the quantified patterns of the rules all of them match, the ones at least one of them matches)
+    node = Composition
+
+    def generate(self):
         for size in range(1, self.size - 1):
             for arity in range(1, size + 1):
-                for main_program in NoIdentityNorProjection(arity, size):
+                for main_program in NoIdentityNorProjection.table(arity, size, self.rules):
                     for compound_program in self._compound(arity, self.size - 1 - size):
-                        if main_program == Recursion(Zero(), Right(Identity())) and all(
-                                all(isinstance(child, Successor) or isinstance(child, Composition) for child in
-                                    compound) for compound in compound_program):
-                            continue
-                        if main_program == Recursion(Identity(), Left(Right(Successor()))) and Zero() in compound_program:
-                            continue
-                        if all(isinstance(child, Successor) or isinstance(child, Composition) for child in
-                               main_program):
-                            if all(all(isinstance(child, Successor) or isinstance(child, Composition) for child in
-                                       compound) for compound in compound_program):
-                                if isinstance(main_program, Composition):
-                                    continue
-                        yield Composition(main_program, *compound_program)
+                        if not self.rules.rejects(Composition, (main_program, *compound_program)):
+                            yield Composition(main_program, *compound_program)
+
+    def allowed(self, main, compounds):
+        # the rules of generate() on the shape of the main program and the summary of the compounds
+        _, every, some = compounds
+        return self.rules.admits(Composition, (main,), every, some)
+
+    def result(self, main, compounds):
+        children, every, _ = compounds
+        if children is not None:
+            children = (main, *children)
+        return shape(Composition, self.arity, main.successive and SUCCESSIVE in every, children, self.rules)
+
+    def census(self):
+        census = Counter()
+        for size, arity in self._blocks():
+            compounds = self._summaries(arity, arity, self.size - 1 - size)
+            for main, main_count in NoIdentityNorProjection.census_table(arity, size, self.rules).items():
+                for summary, count in compounds.items():
+                    if self.allowed(main, summary):
+                        census[self.result(main, summary)] += main_count * count
+        return census
+
+    def locate(self, weight, index):
+        for size, arity in self._blocks():
+            main_weight = self._main_weight(weight, arity, self.size - 1 - size)
+            total = weighted(main_weight, NoIdentityNorProjection.census_table(arity, size, self.rules))
+            if index < total:
+                main, index = NoIdentityNorProjection(arity, size, self.rules).locate(main_weight, index)
+                compound_weight = self._compound_weight(weight, shape_of(main, self.rules))
+                compounds, index = self._locate_compounds(compound_weight, arity, self.size - 1 - size, index)
+                return Composition(main, *compounds), index
+            index -= total
+        raise IndexError(f"{self.__class__.__name__}({self.arity}, {self.size}) index out of range")
+
+    def position(self, weight, program):
+        main = program.children[0]
+        prefix = 0
+        for size, arity in self._blocks():
+            main_weight = self._main_weight(weight, arity, self.size - 1 - size)
+            if (size, arity) == (size_of(main), main.arity):
+                prefix += NoIdentityNorProjection(arity, size, self.rules).position(main_weight, main)
+                compound_weight = self._compound_weight(weight, shape_of(main, self.rules))
+                return prefix + self._position_compounds(compound_weight, arity, self.size - 1 - size, program)
+            prefix += weighted(main_weight, NoIdentityNorProjection.census_table(arity, size, self.rules))
+        raise self._missing(program)
+
+    def _blocks(self):
+        for size in range(1, self.size - 1):
+            for arity in range(1, size + 1):
+                yield size, arity
+
+    def _main_weight(self, weight, n, size):
+        summaries = self._summaries(n, n, size)
+
+        @lru_cache(maxsize=None)
+        def main_weight(main):
+            return sum(count * weight(self.result(main, summary)) for summary, count in summaries.items()
+                       if self.allowed(main, summary))
+        return main_weight
+
+    def _compound_weight(self, weight, main):
+        def compound_weight(summary):
+            return weight(self.result(main, summary)) if self.allowed(main, summary) else 0
+        return compound_weight
+
+    def _parts(self, n):
+        return NoIdentityNorProjection if n == 1 else Generator
+
+    def _lengths(self, parts, size):
+        # the lengths the next compound can take, as in _composition
+        if parts == 1:
+            return size,
+        min_length = 1 if self.arity == 0 else self.arity
+        return range(min_length, size - (parts - 1) * min_length + 1)
+
+    def _empty(self, n):
+        return () if n + 1 <= self.rules.width else None, frozenset(self.rules.quantified), frozenset()
+
+    def _single(self, n, compound):
+        summary = self.rules.summary(compound)
+        return (compound,) if n + 1 <= self.rules.width else None, summary, summary
+
+    @staticmethod
+    def _combine(first, second):
+        return None if first[0] is None else first[0] + second[0], first[1] & second[1], first[2] | second[2]
+
+    def _fold(self, n, summaries, length):
+        folded = Counter()
+        for compound, compound_count in self._parts(n).census_table(self.arity, length, self.rules).items():
+            for summary, count in summaries.items():
+                folded[self._combine(summary, self._single(n, compound))] += count * compound_count
+        return folded
+
+    def _summaries(self, n, parts, size):
+        # summaries of the last parts compounds of an n-tuple, when they weigh size together
+        key = (CompositionGenerator, self.arity, n, parts, size, self.rules)
+        if key not in Generation.censuses:
+            summaries = Counter()
+            if not parts:
+                if not size:
+                    summaries[self._empty(n)] = 1
+            else:
+                for length in self._lengths(parts, size):
+                    for rest, rest_count in self._summaries(n, parts - 1, size - length).items():
+                        for summary, count in self._fold(n, Counter({self._empty(n): 1}), length).items():
+                            summaries[self._combine(summary, rest)] += count * rest_count
+            Generation.censuses[key] = summaries
+        return Generation.censuses[key]
+
+    def _block(self, weight, n, prefixes, parts, size):
+        return sum(count * rest_count * weight(self._combine(prefix, rest))
+                   for prefix, count in prefixes.items()
+                   for rest, rest_count in self._summaries(n, parts, size).items())
+
+    def _suffixes(self, n, lengths):
+        suffixes = [Counter({self._empty(n): 1})]
+        for length in reversed(lengths[1:]):
+            folded = Counter()
+            for summary, count in self._fold(n, Counter({self._empty(n): 1}), length).items():
+                for rest, rest_count in suffixes[0].items():
+                    folded[self._combine(summary, rest)] += count * rest_count
+            suffixes.insert(0, folded)
+        return suffixes
+
+    def _part_weight(self, weight, n, prefix, suffix):
+        @lru_cache(maxsize=None)
+        def part_weight(compound):
+            head = self._combine(prefix, self._single(n, compound))
+            return sum(count * weight(self._combine(head, rest)) for rest, count in suffix.items())
+        return part_weight
+
+    def _locate_compounds(self, weight, n, size, index):
+        lengths = []
+        prefixes = Counter({self._empty(n): 1})
+        for i in range(n):
+            for length in self._lengths(n - i, size):
+                folded = self._fold(n, prefixes, length)
+                total = self._block(weight, n, folded, n - 1 - i, size - length)
+                if index < total:
+                    break
+                index -= total
+            else:
+                raise IndexError(f"{self.__class__.__name__}({self.arity}, {self.size}) index out of range")
+            lengths.append(length)
+            prefixes = folded
+            size -= length
+        compounds = []
+        prefix = self._empty(n)
+        for length, suffix in zip(lengths, self._suffixes(n, lengths)):
+            compound, index = self._parts(n)(self.arity, length, self.rules).locate(
+                self._part_weight(weight, n, prefix, suffix), index)
+            compounds.append(compound)
+            prefix = self._combine(prefix, self._single(n, shape_of(compound, self.rules)))
+        return compounds, index
+
+    def _position_compounds(self, weight, n, size, program):
+        compounds = program.children[1:]
+        position = 0
+        lengths = [size_of(compound) for compound in compounds]
+        prefixes = Counter({self._empty(n): 1})
+        for i, length in enumerate(lengths):
+            lengths_before = [other for other in self._lengths(n - i, size) if other < length]
+            if length not in self._lengths(n - i, size):
+                raise self._missing(program)
+            for other in lengths_before:
+                position += self._block(weight, n, self._fold(n, prefixes, other), n - 1 - i, size - other)
+            prefixes = self._fold(n, prefixes, length)
+            size -= length
+        prefix = self._empty(n)
+        for length, suffix, compound in zip(lengths, self._suffixes(n, lengths), compounds):
+            position += self._parts(n)(self.arity, length, self.rules).position(
+                self._part_weight(weight, n, prefix, suffix), compound)
+            prefix = self._combine(prefix, self._single(n, shape_of(compound, self.rules)))
+        if not weight(prefix):
+            raise self._missing(program)
+        return position
 
     def _compound(self, n, size):
         for composition in self._composition(n, size):
             if len(composition) == 1:
-                for prod in product(*[NoIdentityNorProjection(self.arity, l) for l in composition]):
+                for prod in product(*[NoIdentityNorProjection.table(self.arity, l, self.rules) for l in composition]):
                     yield prod
             else:
-                for prod in product(*[Generator(self.arity, l) for l in composition]):
+                for prod in product(*[Generator.table(self.arity, l, self.rules) for l in composition]):
                     yield prod
 
     def _composition(self, n, size):
@@ -62,97 +365,184 @@ class CompositionGenerator(Generation):
 
 
 class RecursionGenerator(Generation):
-    def __iter__(self):
+    node = Recursion
+
+    def generate(self):
         for size in range(1, self.size - 1):
-            for recursive in Generator(self.arity + 1, self.size - 1 - size):
-                if recursive == Left(Identity()):
-                    continue
-                for zero in Generator(self.arity - 1, size):
-                    if zero == Zero():
-                        if recursive == Left(Left(Zero())):
-                            continue
-                        if recursive == Left(Recursion(Zero(), Function(2))):
-                            continue
-                        if recursive == Recursion(Left(Zero()), Left(Function(2))):
-                            continue
-                        if recursive == Left(Successor()):
-                            continue
-                        if recursive == Right(Successor()):
-                            continue
-                        if recursive == Right(Composition(Successor(), Successor())):
-                            continue
-                        if recursive == Recursion(Identity(), Left(Left(Successor()))):
-                            continue
-                        if recursive == Recursion(Successor(), Left(Left(Successor()))):
-                            continue
-                        if recursive == Recursion(Identity(), Left(Right(Identity()))):
-                            continue
-                        if recursive == Recursion(Successor(), Left(Right(Identity()))):
-                            continue
-                        if recursive == Recursion(Identity(), Right(Right(Successor()))):
-                            continue
-                    if zero == Identity() and recursive == Left(Left(Identity())):
-                        continue
-                    if isinstance(zero, Right) and isinstance(recursive, Right):
-                        continue
-                    if zero == Composition(Successor(), Zero()) and recursive == Left(Successor()):
-                        continue
-                    yield Recursion(zero, recursive)
+            for recursive in Generator.table(self.arity + 1, self.size - 1 - size, self.rules):
+                for zero in Generator.table(self.arity - 1, size, self.rules):
+                    if not self.rules.rejects(Recursion, (zero, recursive)):
+                        yield Recursion(zero, recursive)
+
+    def allowed(self, zero, recursive):
+        # the rules of generate() on the shapes of the children
+        return self.rules.admits(Recursion, (zero, recursive))
+
+    def result(self, zero, recursive):
+        return shape(Recursion, self.arity, False, (zero, recursive), self.rules)
+
+    def census(self):
+        census = Counter()
+        for size in range(1, self.size - 1):
+            zeros = Generator.census_table(self.arity - 1, size, self.rules)
+            recursives = Generator.census_table(self.arity + 1, self.size - 1 - size, self.rules)
+            for recursive, recursive_count in recursives.items():
+                for zero, zero_count in zeros.items():
+                    if self.allowed(zero, recursive):
+                        census[self.result(zero, recursive)] += zero_count * recursive_count
+        return census
+
+    def locate(self, weight, index):
+        for size in range(1, self.size - 1):
+            recursive_weight = self._recursive_weight(weight, size)
+            total = weighted(recursive_weight, Generator.census_table(self.arity + 1, self.size - 1 - size, self.rules))
+            if index < total:
+                recursive, index = Generator(self.arity + 1, self.size - 1 - size, self.rules).locate(recursive_weight,
+                                                                                                      index)
+                zero_weight = self._zero_weight(weight, shape_of(recursive, self.rules))
+                zero, index = Generator(self.arity - 1, size, self.rules).locate(zero_weight, index)
+                return Recursion(zero, recursive), index
+            index -= total
+        raise IndexError(f"{self.__class__.__name__}({self.arity}, {self.size}) index out of range")
+
+    def position(self, weight, program):
+        zero, recursive = program.children
+        prefix = 0
+        for size in range(1, size_of(zero)):
+            prefix += weighted(self._recursive_weight(weight, size),
+                               Generator.census_table(self.arity + 1, self.size - 1 - size, self.rules))
+        prefix += Generator(self.arity + 1, self.size - 1 - size_of(zero), self.rules).position(
+            self._recursive_weight(weight, size_of(zero)), recursive)
+        if not self.allowed(shape_of(zero, self.rules), shape_of(recursive, self.rules)):
+            raise self._missing(program)
+        return prefix + Generator(self.arity - 1, size_of(zero), self.rules).position(
+            self._zero_weight(weight, shape_of(recursive, self.rules)), zero)
+
+    def _recursive_weight(self, weight, size):
+        zeros = Generator.census_table(self.arity - 1, size, self.rules)
+
+        @lru_cache(maxsize=None)
+        def recursive_weight(recursive):
+            return sum(count * weight(self.result(zero, recursive)) for zero, count in zeros.items()
+                       if self.allowed(zero, recursive))
+        return recursive_weight
+
+    def _zero_weight(self, weight, recursive):
+        def zero_weight(zero):
+            return weight(self.result(zero, recursive)) if self.allowed(zero, recursive) else 0
+        return zero_weight
 
 
 class Generator(Generation):
-    def __iter__(self):
+    def generate(self):
+        for part in self.parts():
+            if isinstance(part, type):
+                yield from self.part(part)
+            else:
+                yield from part
+
+    def census(self):
+        census = Counter()
+        for part in self.parts():
+            if isinstance(part, type):
+                census.update(part.census_table(self.arity, self.size, self.rules))
+            else:
+                census.update((shape_of(atom, self.rules) for atom in part))
+        return census
+
+    def locate(self, weight, index):
+        for part in self.parts():
+            if isinstance(part, type):
+                total = weighted(weight, part.census_table(self.arity, self.size, self.rules))
+                if index < total:
+                    return part(self.arity, self.size, self.rules).locate(weight, index)
+            else:
+                for program in part:
+                    total = weight(shape_of(program, self.rules))
+                    if index < total:
+                        return program, index
+                    index -= total
+                continue
+            index -= total
+        raise IndexError(f"{self.__class__.__name__}({self.arity}, {self.size}) index out of range")
+
+    def position(self, weight, program):
+        prefix = 0
+        for part in self.parts():
+            if isinstance(part, type):
+                if isinstance(program, part.node):
+                    return prefix + part(self.arity, self.size, self.rules).position(weight, program)
+                prefix += weighted(weight, part.census_table(self.arity, self.size, self.rules))
+            else:
+                for atom in part:
+                    if atom is program:
+                        return prefix
+                    prefix += weight(shape_of(atom, self.rules))
+        raise self._missing(program)
+
+    def __len__(self):
+        return self.count(self.arity, self.size, self.rules)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"{self.__class__.__name__}({self.arity}, {self.size}) index out of range")
+        return self.locate(unit, index)[0]
+
+    @classmethod
+    def rank(cls, program):
+        return cls(program.arity, size_of(program)).position(unit, program)
+
+    def parts(self):
         if self.size == 1:
             if self.arity == 0:
-                yield from self.zero()
+                yield self.zero()
             elif self.arity == 1:
-                yield from self.identity()
-                yield from self.successor()
+                yield self.identity()
+                yield self.successor()
         elif self.size > 1:
-            yield from self.composition()
+            yield self.composition()
             if self.arity:
-                yield from self.left()
-                yield from self.right()
-                yield from self.recursion()
+                yield self.left()
+                yield self.right()
+                yield self.recursion()
 
     def zero(self):
-        yield Zero()
+        return ZERO,
 
     def identity(self):
-        yield Identity()
+        return IDENTITY,
 
     def successor(self):
-        yield Successor()
+        return Successor(),
 
     def composition(self):
-        yield from CompositionGenerator(self.arity, self.size)
+        return CompositionGenerator
 
     def left(self):
-        yield from LeftGenerator(self.arity, self.size)
+        return LeftGenerator
 
     def right(self):
-        yield from RightGenerator(self.arity, self.size)
+        return RightGenerator
 
     def recursion(self):
-        yield from RecursionGenerator(self.arity, self.size)
+        return RecursionGenerator
 
 
 class NoLeft(Generator):
     def left(self):
-        if False:
-            yield
+        return ()
 
 
 class NoIdentity(Generator):
     def identity(self):
-        if False:
-            yield
+        return ()
 
 
 class NoRight(Generator):
     def right(self):
-        if False:
-            yield
+        return ()
 
 
 class NoProjection(NoLeft, NoRight):
@@ -164,8 +554,92 @@ class NoIdentityNorProjection(NoIdentity, NoProjection):
 
 
 class Main(NoProjection):
-    def __len__(self):
-        return len(list(iter(self)))
+    streaming = True
+
+
+class Equivalence:
+    # optional observational pruning: a program whose outputs on a few inputs are the ones of a program already
+    # kept in the same table (generator, arity and size) is taken as equivalent to it and left out of the tables
+    # larger programs are built from, so every table keeps a program of each outputs. Programs that overflow on an
+    # input are always kept. The census, count and rank of the generators ignore the pruning
+    def __init__(self, width=64, step=1000, limit=1 << 20):
+        self.width = width
+        self.tabulation = Tabulation(step)
+        self.limit = limit
+        self.inputs = dict()
+        self.representatives = dict()
+        self.decisions = dict()
+        self.generated = Counter()
+        self.kept = Counter()
+
+    def points(self, arity):
+        # the inputs of the fingerprints: a grid of side at least 2, or width of its tuples taken with a stride
+        # coprime to its size when it has more, so that every coordinate varies
+        if arity not in self.inputs:
+            side = 2
+            while arity and (side + 1) ** arity <= self.width:
+                side += 1
+            total = side ** arity
+            if total <= self.width:
+                self.inputs[arity] = list(product(range(side), repeat=arity))
+            else:
+                stride = int(total * 0.618) | 1
+                while gcd(stride, total) != 1:
+                    stride += 2
+                self.inputs[arity] = [tuple(i * stride % total // side ** j % side for j in range(arity))
+                                      for i in range(self.width)]
+        return self.inputs[arity]
+
+    def fingerprint(self, program):
+        if len(self.tabulation.table) > self.limit:
+            self.tabulation.table.clear()
+        outputs = tuple(self.tabulation.execute(program, x)[1] for x in self.points(program.arity))
+        return None if None in outputs else outputs
+
+    def filter(self, cls, arity, size, programs):
+        for program in programs:
+            if (cls, program) not in self.decisions:
+                fingerprint = self.fingerprint(program)
+                representative = program if fingerprint is None else self.representatives.setdefault(
+                    (cls, arity, size, fingerprint), program)
+                self.decisions[cls, program] = representative is program
+                self.generated[arity, size] += 1
+                self.kept[arity, size] += self.decisions[cls, program]
+            if self.decisions[cls, program]:
+                yield program
+
+    def report(self):
+        for arity, size in sorted(self.generated):
+            generated, kept = self.generated[arity, size], self.kept[arity, size]
+            print(f"arity {arity} size {size}: {kept} / {generated} kept, {1 - kept / generated:.1%} removed")
+        generated, kept = sum(self.generated.values()), sum(self.kept.values())
+        print(f"total: {kept} / {generated} kept, {1 - kept / (generated or 1):.1%} removed")
+
+
+def pruned(pattern, arity, size):
+    # programs of Main(arity, size) that the rule pattern alone rejects: the census without the rule less the one
+    # with all of them
+    rules = Rules([other for other in RULES.patterns if other is not pattern])
+    count = Main.count(arity, size, rules) - Main.count(arity, size)
+    for key in [key for key in Generation.censuses if rules in key]:
+        del Generation.censuses[key]
+    return count
+
+
+def report(arity, sizes, seconds):
+    # the statistics of the rules of a run over Main(arity, size) for the sizes, each rule completed with the
+    # programs it alone prunes and the time their search would have taken at seconds per program
+    data = RULES.statistics.dump(RULES)
+    for pattern, rule in zip(RULES.patterns, data['rules']):
+        rule['pruned'] = sum(pruned(pattern, arity, size) for size in sizes)
+        rule['saved'] = rule['pruned'] * seconds
+        hits, checks = rule['hits'], rule['checks']
+        print(f"{rule['rule']}: {hits} / {checks} rejected, {rule['isolated_seconds']:.3f}s matched alone, "
+              f"{rule['pruned']} programs pruned alone, ~{rule['saved']:.1f}s saved{'' if hits else ', dead'}")
+    rejected, candidates, spent = (sum(entry[key] for entry in data['sizes'])
+                                   for key in ('rejected', 'candidates', 'seconds'))
+    print(f"total: {rejected} / {candidates} candidates rejected in {spent:.3f}s by the trie")
+    return data
 
 
 def main():
@@ -0,0 +1,136 @@
+from execution import *
+
+ZERO, IDENTITY, SUCCESSOR, LEFT, RIGHT, COMPOSITION, RECURSION = range(7)
+
+
+class Assembler:
+    # lays a Function tree out in a flat code list, in prefix order:
+    #   Z / I / S            [op]
+    #   < / >                [op, child]
+    #   o                    [op, n, main, compound_1, ..., compound_n]
+    #   R                    [op, zero, recursive]
+    # arities[pc] is the arity of the function starting at pc
+
+    def __init__(self):
+        self.code = []
+        self.arities = []
+        self.operations = {Zero: ZERO, Identity: IDENTITY, Successor: SUCCESSOR, Left: LEFT, Right: RIGHT,
+                           Composition: COMPOSITION, Recursion: RECURSION}
+
+    def assemble(self, function):
+        # lays function out with a prefix walk on an explicit stack of the nodes and the operand to patch with their
+        # position, None for function itself, returns its position
+        start = len(self.code)
+        stack = [(function, None)]
+        while stack:
+            function, operand = stack.pop()
+            pc = len(self.code)
+            if operand is not None:
+                self.code[operand] = pc
+            self.code.append(self.operations[function.__class__])
+            if isinstance(function, Composition):
+                self.code.append(len(function.children) - 1)
+            operands = len(self.code)
+            self.code.extend([0] * len(function.children))
+            self.arities.extend([function.arity] * (len(self.code) - pc))
+            stack.extend((child, operands + i) for i, child in reversed(list(enumerate(function.children))))
+        return start
+
+
+class Machine:
+    # every thunk is an integer indexing the arrays values / nodes / frames, its parameters being the thunks
+    # env[frames[t]:frames[t] + arity] ; a projection only moves the frame offset, so only Composition and
+    # Recursion allocate, and the loop charges one step exactly where the lazy stack engine does
+
+    def __init__(self, program):
+        self.program = program
+        assembler = Assembler()
+        assembler.assemble(program)
+        self.code = assembler.code
+        self.arities = assembler.arities
+
+    def __str__(self):
+        return str(self.program)
+
+    __repr__ = __str__
+
+    def execute(self, *params, step=-1, display=(), bin_output=False, token=None, poll=1024):
+        if display:
+            return self.program.execute(*params, step=step, display=display, bin_output=bin_output, token=token,
+                                        poll=poll)
+        if self.program.arity != len(params):
+            raise ArityException(self.program, self.program.arity, len(params))
+        code = self.code
+        arities = self.arities
+        values = list(params) + [None]
+        nodes = [0] * len(values)
+        frames = [0] * len(values)
+        env = list(range(len(params)))
+        root = len(params)
+        stack = [root]
+        step_counter = 0
+        checkpoint = -1 if token is None else poll
+        while stack and (step == -1 or step > step_counter):
+            if bin_output and values[root] is None and code[nodes[root]] == SUCCESSOR:
+                return step_counter, True
+            step_counter += 1
+            if step_counter == checkpoint:
+                if token.cancelled():
+                    raise Cancelled(step_counter)
+                checkpoint += poll
+            thunk = stack[-1]
+            if values[thunk] is not None:
+                stack.pop()
+                continue
+            pc = nodes[thunk]
+            operation = code[pc]
+            frame = frames[thunk]
+            if operation == ZERO:
+                values[thunk] = 0
+            elif operation == IDENTITY:
+                x = env[frame]
+                if values[x] is None:
+                    stack.append(x)
+                else:
+                    values[thunk] = values[x]
+            elif operation == SUCCESSOR:
+                x = env[frame]
+                if values[x] is None:
+                    stack.append(x)
+                else:
+                    values[thunk] = values[x] + 1
+            elif operation == LEFT:
+                nodes[thunk] = code[pc + 1]
+                frames[thunk] = frame + 1
+            elif operation == RIGHT:
+                nodes[thunk] = code[pc + 1]
+            elif operation == COMPOSITION:
+                n = code[pc + 1]
+                first = len(values)
+                values.extend([None] * n)
+                nodes.extend(code[pc + 3:pc + 3 + n])
+                frames.extend([frame] * n)
+                nodes[thunk] = code[pc + 2]
+                frames[thunk] = len(env)
+                env.extend(range(first, first + n))
+            else:
+                x = env[frame]
+                if values[x] is None:
+                    stack.append(x)
+                elif values[x]:
+                    ne = len(values)
+                    values.extend((values[x] - 1, None))
+                    nodes.extend((0, pc))
+                    frames.extend((0, len(env)))
+                    rest = env[frame + 1:frame + arities[pc]]
+                    env.append(ne)
+                    env.extend(rest)
+                    nodes[thunk] = code[pc + 2]
+                    frames[thunk] = len(env)
+                    env.append(ne)
+                    env.append(ne + 1)
+                    env.extend(rest)
+                else:
+                    nodes[thunk] = code[pc + 1]
+                    frames[thunk] = frame + 1
+        return step_counter, values[stack[-1]] if stack else values[root]
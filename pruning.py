@@ -0,0 +1,358 @@
+import os
+from collections import Counter, namedtuple
+from time import perf_counter
+
+from execution import *
+
+# a rule is the pattern of the programs it rejects, written with the letters of the language:
+#   _                any program
+#   $name            any program satisfying the predicate name
+#   p&q              any program matching both p and q
+#   Z I S            the atoms, < and > followed by the pattern of their child
+#   o(p, ...)        R(p, q) the programs whose children match the patterns, the last child pattern may be *p or +p,
+#                    matched by the remaining children if all of them, respectively some of them, match p
+Pattern = namedtuple('Pattern', ('cls', 'children', 'rest'))
+Conjunction = namedtuple('Conjunction', ('first', 'second'))
+ANY = '_'
+EVERY, SOME = '*', '+'
+SUCCESSIVE = '$successive'
+
+# predicates on programs and on their shapes, None when the shapes do not tell
+PREDICATES = {
+    SUCCESSIVE: (lambda program: not program.features & ~(Successor.feature | Composition.feature),
+                 lambda shape: shape.successive),
+    '$nosuccessor': (lambda program: not program.features & Successor.feature, None),
+}
+
+
+class Parser:
+    def __init__(self, text):
+        self.text = ''.join(text.split())
+        self.index = 0
+
+    def parse(self):
+        pattern = self.conjunction()
+        if self.index != len(self.text):
+            raise InvalidProgram(f"unexpected '{self.text[self.index:]}' in rule '{self.text}'")
+        return pattern
+
+    def peek(self):
+        return self.text[self.index] if self.index < len(self.text) else ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise InvalidProgram(f"expected '{char}' at {self.index} in rule '{self.text}'")
+        self.index += 1
+
+    def conjunction(self):
+        pattern = self.term()
+        while self.peek() == '&':
+            self.index += 1
+            pattern = Conjunction(pattern, self.term())
+        return pattern
+
+    def term(self):
+        char = self.peek()
+        self.index += 1
+        if char == ANY:
+            return ANY
+        if char == '$':
+            start = self.index
+            while self.peek().isalpha():
+                self.index += 1
+            predicate = '$' + self.text[start:self.index]
+            if predicate not in PREDICATES:
+                raise InvalidProgram(f"unknown predicate '{predicate}' in rule '{self.text}'")
+            return predicate
+        if char not in language.functions:
+            raise InvalidProgram(f"unexpected '{char}' at {self.index - 1} in rule '{self.text}'")
+        cls = language[char]
+        if issubclass(cls, Projection):
+            return Pattern(cls, (self.term(),), None)
+        if cls not in (Composition, Recursion):
+            return Pattern(cls, (), None)
+        self.expect('(')
+        children, rest = [], None
+        while rest is None:
+            if self.peek() in (EVERY, SOME):
+                quantifier = self.peek()
+                self.index += 1
+                rest = quantifier, self.conjunction()
+            else:
+                children.append(self.conjunction())
+            if self.peek() != ',':
+                break
+            self.index += 1
+        self.expect(')')
+        return Pattern(cls, tuple(children), rest)
+
+
+def flatten(pattern):
+    # the edges of the path of pattern in a Trie, in prefix order
+    if isinstance(pattern, Pattern):
+        edges = [('variadic' if pattern.rest else 'exact', (pattern.cls, len(pattern.children)))]
+        for child in pattern.children:
+            edges.extend(flatten(child))
+        if pattern.rest:
+            edges.append(('groups', pattern.rest))
+        return edges
+    return [('tests', pattern)]
+
+
+def unparse(pattern):
+    if isinstance(pattern, Pattern):
+        letter = language[pattern.cls]
+        if issubclass(pattern.cls, Projection):
+            return letter + unparse(pattern.children[0])
+        if pattern.cls not in (Composition, Recursion):
+            return letter
+        items = [unparse(child) for child in pattern.children]
+        if pattern.rest:
+            items.append(pattern.rest[0] + unparse(pattern.rest[1]))
+        return f"{letter}({', '.join(items)})"
+    if isinstance(pattern, Conjunction):
+        return f"{unparse(pattern.first)}&{unparse(pattern.second)}"
+    return pattern
+
+
+def matches(pattern, program):
+    if pattern == ANY:
+        return True
+    if isinstance(pattern, Pattern):
+        return matches_node(pattern, program.__class__, program.children)
+    if isinstance(pattern, Conjunction):
+        return matches(pattern.first, program) and matches(pattern.second, program)
+    return PREDICATES[pattern][0](program)
+
+
+def matches_node(pattern, cls, children):
+    if cls is not pattern.cls or not fits(pattern, len(children)):
+        return False
+    n = len(pattern.children)
+    if not all(matches(child, other) for child, other in zip(pattern.children, children)):
+        return False
+    return pattern.rest is None or quantify(pattern.rest, children[n:], matches)
+
+
+def fits(pattern, length):
+    return length == len(pattern.children) or pattern.rest is not None and length > len(pattern.children)
+
+
+def quantify(rest, programs, match):
+    quantifier, pattern = rest
+    if quantifier == EVERY:
+        return all(match(pattern, program) for program in programs)
+    return any(match(pattern, program) for program in programs)
+
+
+class Trie:
+    # node of a discrimination trie: the edges of a program node are keyed on its class and number of children,
+    # exact for the patterns with a fixed number of children, variadic (by class, then by the number of children
+    # before the *p or +p) for the ones ending with *p or +p. tests are the patterns matched as a whole (_,
+    # predicates, conjunctions) and groups the *p or +p on the remaining children. rule is the first rule whose
+    # path ends here
+    __slots__ = ('exact', 'variadic', 'tests', 'groups', 'rule')
+
+    def __init__(self):
+        self.exact = dict()
+        self.variadic = dict()
+        self.tests = dict()
+        self.groups = dict()
+        self.rule = None
+
+    def child(self, kind, key):
+        edges = getattr(self, kind)
+        if kind == 'variadic':
+            cls, key = key
+            edges = edges.setdefault(cls, dict())
+        return edges.setdefault(key, Trie())
+
+
+class Statistics:
+    # counters of the rules of a profile by (rule, arity, size) of the candidates: checks, hits (rejections) and
+    # seconds spent matching the rule on its own, and by (arity, size) the candidates, the rejected ones and the
+    # seconds spent in the trie, which is what the pruning actually costs
+    def __init__(self):
+        self.checks = Counter()
+        self.hits = Counter()
+        self.isolated = Counter()
+        self.candidates = Counter()
+        self.rejected = Counter()
+        self.seconds = Counter()
+
+    def dump(self, rules):
+        return {'rules': [{'rule': unparse(pattern),
+                           'checks': sum(self.checks[key] for key in self.checks if key[0] == index),
+                           'hits': sum(self.hits[key] for key in self.hits if key[0] == index),
+                           'isolated_seconds': sum(self.isolated[key] for key in self.isolated if key[0] == index),
+                           'sizes': [{'arity': arity, 'size': size, 'checks': self.checks[index, arity, size],
+                                      'hits': self.hits[index, arity, size],
+                                      'isolated_seconds': self.isolated[index, arity, size]}
+                                     for _, arity, size in sorted(key for key in self.checks if key[0] == index)]}
+                          for index, pattern in enumerate(rules.patterns)],
+                'sizes': [{'arity': arity, 'size': size, 'candidates': self.candidates[arity, size],
+                           'rejected': self.rejected[arity, size], 'seconds': self.seconds[arity, size]}
+                          for arity, size in sorted(self.candidates)]}
+
+
+class Rules:
+    # a pruning profile: the rules of the programs a generator does not yield, compiled into a discrimination trie
+    # on the classes of the nodes in prefix order, so that a candidate is checked against all the rules in one
+    # traversal. The shapes of the generators are checked against the same rules, see admits
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self.trie = Trie()
+        for pattern in self.patterns:
+            trie = self.trie
+            for kind, key in flatten(pattern):
+                trie = trie.child(kind, key)
+            if trie.rule is None:
+                trie.rule = pattern
+        subpatterns = []
+        for pattern in self.patterns:
+            self._collect(pattern, subpatterns, root=True)
+        self.subpatterns = tuple(dict.fromkeys(subpatterns))
+        self.quantified = tuple(dict.fromkeys([SUCCESSIVE] + [pattern.rest[1] for pattern in self.patterns
+                                                              if pattern.cls is Composition and pattern.rest]))
+        self.width = max((len(pattern.children) for pattern in self.subpatterns if pattern.cls is Composition),
+                         default=0)
+        self.summaries = dict()
+        self.admissions = dict()
+        self.statistics = None
+
+    @classmethod
+    def load(cls, name):
+        # the profile rules/name next to this file, one rule per line, # starting a comment
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules', name)) as file:
+            lines = [line.split('#')[0].strip() for line in file]
+        return cls(Parser(line).parse() for line in lines if line)
+
+    def _collect(self, pattern, subpatterns, root=False):
+        if isinstance(pattern, Conjunction):
+            self._collect(pattern.first, subpatterns)
+            self._collect(pattern.second, subpatterns)
+        elif isinstance(pattern, Pattern):
+            if not root:
+                subpatterns.append(pattern)
+            for child in pattern.children:
+                self._collect(child, subpatterns)
+            if pattern.rest:
+                self._collect(pattern.rest[1], subpatterns)
+
+    def rejection(self, cls, children):
+        # the first rule found rejecting the program cls(*children), None if no rule rejects it
+        pending = self._expand(self.trie, cls, children, ())
+        while pending:
+            trie, todo = pending.pop()
+            if not todo:
+                if trie.rule is not None:
+                    return trie.rule
+                continue
+            item, todo = todo[0], todo[1:]
+            if isinstance(item, tuple):
+                for rest, following in trie.groups.items():
+                    if quantify(rest, item, matches):
+                        pending.append((following, todo))
+                continue
+            pending.extend(self._expand(trie, item.__class__, item.children, todo))
+            for test, following in trie.tests.items():
+                if matches(test, item):
+                    pending.append((following, todo))
+        return None
+
+    def rejects(self, cls, children):
+        if self.statistics is not None:
+            return self._instrumented(cls, children)
+        return self.rejection(cls, children) is not None
+
+    def _instrumented(self, cls, children):
+        # the candidate is decided and timed by the trie, as without statistics, then the rules are matched one by
+        # one to count their checks and hits, each timed on its own
+        arity = children[0].arity + 1 if cls is Recursion else children[-1].arity
+        size = 1 + sum(child.size for child in children)
+        statistics = self.statistics
+        start = perf_counter()
+        rejected = self.rejection(cls, children) is not None
+        statistics.seconds[arity, size] += perf_counter() - start
+        for index, pattern in enumerate(self.patterns):
+            if pattern.cls is not cls:
+                continue
+            start = perf_counter()
+            hit = matches_node(pattern, cls, children)
+            statistics.isolated[index, arity, size] += perf_counter() - start
+            statistics.checks[index, arity, size] += 1
+            statistics.hits[index, arity, size] += hit
+        statistics.candidates[arity, size] += 1
+        statistics.rejected[arity, size] += rejected
+        return rejected
+
+    @staticmethod
+    def _expand(trie, cls, children, todo):
+        # the states following the node cls(*children) from trie, its children being matched next
+        states = []
+        following = trie.exact.get((cls, len(children)))
+        if following is not None:
+            states.append((following, children + todo))
+        for n, following in trie.variadic.get(cls, {}).items():
+            if n <= len(children):
+                states.append((following, children[:n] + (children[n:],) + todo))
+        return states
+
+    def matching(self, cls, children):
+        # the subpatterns matched by the programs of class cls whose children have the shapes children, children
+        # being None if there are more than width of them
+        return frozenset(pattern for pattern in self.subpatterns
+                         if pattern.cls is cls and self._fits_shapes(pattern, children))
+
+    def _fits_shapes(self, pattern, children):
+        if children is None:
+            if pattern.rest is None:
+                return False
+            if any(child != ANY for child in pattern.children) or pattern.rest[1] != ANY:
+                raise ValueError(f"the rule pattern {pattern} cannot be checked on the shapes of wide programs")
+            return True
+        if not fits(pattern, len(children)):
+            return False
+        n = len(pattern.children)
+        if not all(self.shape_matches(child, other) for child, other in zip(pattern.children, children)):
+            return False
+        return pattern.rest is None or quantify(pattern.rest, children[n:], self.shape_matches)
+
+    def shape_matches(self, pattern, shape):
+        if pattern == ANY:
+            return True
+        if isinstance(pattern, Pattern):
+            return pattern in shape.matches
+        if isinstance(pattern, Conjunction):
+            return self.shape_matches(pattern.first, shape) and self.shape_matches(pattern.second, shape)
+        predicate = PREDICATES[pattern][1]
+        if predicate is None:
+            raise ValueError(f"the predicate {pattern} cannot be checked on shapes")
+        return predicate(shape)
+
+    def summary(self, shape):
+        # the quantified patterns a child of this shape matches
+        if shape not in self.summaries:
+            self.summaries[shape] = frozenset(pattern for pattern in self.quantified
+                                              if self.shape_matches(pattern, shape))
+        return self.summaries[shape]
+
+    def admits(self, cls, children, every=frozenset(), some=frozenset()):
+        # whether the programs of class cls whose first children have the shapes children are not rejected, the
+        # remaining children matching all the quantified patterns of every and at least one of some
+        key = (cls, children, every, some)
+        if key not in self.admissions:
+            self.admissions[key] = self._admits(cls, children, every, some)
+        return self.admissions[key]
+
+    def _admits(self, cls, children, every, some):
+        for pattern in self.patterns:
+            if pattern.cls is not cls:
+                continue
+            if len(pattern.children) != len(children) or cls is Composition and pattern.rest is None:
+                raise ValueError(f"the rule {pattern} cannot be checked on shapes")
+            if not all(self.shape_matches(child, other) for child, other in zip(pattern.children, children)):
+                continue
+            if pattern.rest is None or pattern.rest[1] in (every if pattern.rest[0] == EVERY else some):
+                return False
+        return True
@@ -1,51 +1,85 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from os import cpu_count
 
-from threading import Thread, Event
 from generator import *
+from timeout import Deadline
 
 
-def test(program, length, result, stop_it, to_delete):
+def test(program, length, max_step, timeout):
+    # first parameter on which the program answers, None if it never does in length, or the budget it ran out of
+    deadline = Deadline(timeout)
     for j in range(length):
-        if stop_it.is_set():
-            to_delete.append(program)
-            return
+        if deadline.cancelled():
+            return 'timeout'
         try:
-            if program.execute(j, bin_output=True)[1]:
-                if j > result[0]:
-                    result.clear()
-                    result.append(j)
-                    result.append(program)
-                elif j == result[0]:
-                    result.append(program)
-                return
+            step, result = program.execute(j, step=max_step, bin_output=True, token=deadline)
+        except Cancelled:
+            return 'timeout'
         except Exception as e:
             print(program)
             print(e)
+            continue
+        if step == max_step:
+            return 'overflow'
+        if result:
+            return j
+    return None
 
 
-def castor(cls, length):
-    for i in cls:
-        print(i, end=' : ')
-        result = [-1]
-        to_delete = []
-        step = 0
-        total = (4**(i-5)) // 100
-        if total < 1:
-            total = 1
-        for program in Main(1, i):
-            step += 1
-            if not step % total:
-                print('|', end='', flush=True)
-            stop_it = Event()
-            stuff_doing_thread = Thread(target=test, args=(program, length, result, stop_it, to_delete))
-            stuff_doing_thread.start()
-            stuff_doing_thread.join(timeout=1)
-            stop_it.set()
-        print()
-        print(result)
-        print(to_delete)
-        print()
+def evaluate(batch, length, max_step, timeout):
+    return [test(program, length, max_step, timeout) for program in batch]
 
 
+def batches(programs, size):
+    programs = iter(programs)
+    batch = tuple(islice(programs, size))
+    while batch:
+        yield batch
+        batch = tuple(islice(programs, size))
+
+
+def outcomes(executor, programs, length, max_step, timeout, size, window):
+    # keeps at most window batches in flight and yields (program, outcome) in the order of programs
+    pending = deque()
+    for batch in batches(programs, size):
+        pending.append((batch, executor.submit(evaluate, batch, length, max_step, timeout)))
+        if len(pending) >= window:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+    while pending:
+        batch, future = pending.popleft()
+        yield from zip(batch, future.result())
+
+
+def castor(cls, length, max_step=10000, timeout=1, workers=None, size=256):
+    workers = workers or cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        for i in cls:
+            print(i, end=' : ')
+            result = [-1]
+            to_delete = []
+            step = 0
+            total = Main.count(1, i) // 100 or 1
+            for program, outcome in outcomes(executor, Main(1, i), length, max_step, timeout, size, 2 * workers):
+                step += 1
+                if not step % total:
+                    print('|', end='', flush=True)
+                if outcome in ('timeout', 'overflow'):
+                    to_delete.append(program)
+                elif outcome is not None:
+                    if outcome > result[0]:
+                        result.clear()
+                        result.append(outcome)
+                        result.append(program)
+                    elif outcome == result[0]:
+                        result.append(program)
+            print()
+            print(result)
+            print(to_delete)
+            print()
+
 
 def main():
     castor(range(20), 20)
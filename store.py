@@ -0,0 +1,80 @@
+import sqlite3
+
+from execution import Cancelled
+
+FINISHED, OVERFLOW, CANCELLED = 'finished', 'overflow', 'cancelled'
+
+
+class Store:
+    # executions already paid for, keyed by program string, parameters and output mode. A finished execution
+    # answers every budget, an overflow answers the budgets up to the one it ran out of, a cancellation nothing.
+    # Under bin_output only the truth value of a stored result is kept
+    def __init__(self, filename=':memory:', flush=1000):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS evaluation (
+                program TEXT NOT NULL,
+                params TEXT NOT NULL,
+                binary INTEGER NOT NULL,
+                budget INTEGER NOT NULL,
+                steps INTEGER NOT NULL,
+                result INTEGER,
+                status TEXT NOT NULL,
+                PRIMARY KEY (program, params, binary)
+            )""")
+        self.flush = flush
+        self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def get(self, program, params, bin_output=False):
+        return self.connection.execute(
+            "SELECT budget, steps, result, status FROM evaluation WHERE program = ? AND params = ? AND binary = ?",
+            (str(program), ','.join(map(str, params)), int(bin_output))).fetchone()
+
+    def put(self, program, params, bin_output, budget, steps, result, status):
+        self.connection.execute("INSERT OR REPLACE INTO evaluation VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (str(program), ','.join(map(str, params)), int(bin_output), budget, steps,
+                                 None if result is None else int(result), status))
+        self.pending += 1
+        if self.pending >= self.flush:
+            self.connection.commit()
+            self.pending = 0
+
+    def lookup(self, program, params, step=-1, bin_output=False):
+        # the (step, result) execute would return, or None if the store cannot tell
+        record = self.get(program, params, bin_output)
+        if record is None:
+            return None
+        budget, steps, result, status = record
+        if status == FINISHED:
+            if step == -1 or steps <= step:
+                return steps, result
+            return step, None
+        if status == OVERFLOW and step != -1 and step <= budget:
+            return step, None
+        return None
+
+    def execute(self, program, *params, step=-1, bin_output=False, token=None, executable=None):
+        known = self.lookup(program, params, step, bin_output)
+        if known is not None:
+            return known
+        executable = executable or program
+        try:
+            steps, result = executable.execute(*params, step=step, bin_output=bin_output, token=token)
+        except Cancelled as cancelled:
+            self.put(program, params, bin_output, step, cancelled.step_counter, None, CANCELLED)
+            raise
+        if steps == step:
+            self.put(program, params, bin_output, step, steps, None, OVERFLOW)
+        else:
+            self.put(program, params, bin_output, step, steps, result, FINISHED)
+        return steps, result
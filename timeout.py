@@ -1,18 +1,23 @@
+from threading import Event
+from time import time
 
-class Language(dict):
 
-    def __getitem__(self, item):
-        if item not in self:
-            def metaclass(name, bases, attributes):
-                self[item] = type(name, bases, attributes)
-                return self[item]
-            return metaclass
-        return super(Language, self).__getitem__(item)
+class Token:
+    # cancellation token polled by Function.execute, cancel() may be called from another thread
+    def __init__(self):
+        self.event = Event()
 
+    def cancel(self):
+        self.event.set()
 
-language = Language()
+    def cancelled(self):
+        return self.event.is_set()
 
-class Zero(metaclass=language['Z']):
-    pass
 
-print(language["Z"])
\ No newline at end of file
+class Deadline(Token):
+    def __init__(self, timeout):
+        super().__init__()
+        self.deadline = time() + timeout
+
+    def cancelled(self):
+        return self.event.is_set() or time() > self.deadline